@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_fetch
+~~~~~~~~~~~~~~~~~~~~~~
+
+Measures the fetch layer against the local station server: requests per second, end to end wall time and peak RSS
+of run_loop, the streaming station run, the iheart path and the parse functions over a range of steps
+
+Usage: python benchmarks/bench_fetch.py [--steps 10 100 1000] [--cases run_loop stream iheart parse]
+                                        [--latency 0.01] [--jitter 0.0] [--error-rate 0.0] [--songs 20]
+                                        [--recordings DIR] [--parse-workers N] [--json]
+
+Every case runs in its own process so that the peak RSS of one case does not hide the next one. For the iheart
+case steps is the number of iheart stations scraped, each being a recently played page and one load_more page.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CASES = ['run_loop', 'stream', 'iheart', 'parse']
+
+
+def run_case(args):
+    """ Run a single case in this process and return its measurements """
+
+    from gmusic.media_resources import MediaResources, create_parse_pool
+    from station_server import StationServer
+
+    server = StationServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           songs_per_response=args.songs, recordings=args.recordings, seed=0).start()
+    parse_pool = create_parse_pool(args.parse_workers) if args.parse_workers else None
+    media_resources = server.configure(MediaResources(steps=args.steps[0], parse_pool=parse_pool),
+                                       iheart_stations=args.steps[0])
+    media_resources.radio_stations['iheart']['pages'] = 1
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    error = None
+    started = time.perf_counter()
+    try:
+        if args.case == 'run_loop':
+            config = media_resources.radio_stations['cbs_stations']
+            url = list(config['urls'].values())[0]
+            responses = loop.run_until_complete(media_resources.run_loop(
+                loop, headers=config['headers'], url=url, params=config['params'], station='cbs_stations',
+                interval=config['interval'], parse=parse_pool is not None))
+            if parse_pool is not None:
+                for songs in responses:
+                    media_resources.music_list.extend(songs)
+            else:
+                media_resources.parse_cbs_station_data(responses)
+        elif args.case == 'stream':
+            loop.run_until_complete(media_resources.run_stations(loop, stations=('cbs_stations', 'tunegenie')))
+        elif args.case == 'iheart':
+            loop.run_until_complete(media_resources.run_stations(loop, stations=('iheart',)))
+        elif args.case == 'parse':
+            cbs_responses = [json.loads(server.bodies['cbs'].decode('utf-8')) for i in range(args.steps[0])]
+            tunegenie_responses = [json.loads(server.bodies['tunegenie'].decode('utf-8'))
+                                   for i in range(args.steps[0])]
+            started = time.perf_counter()
+            media_resources.parse_cbs_station_data(cbs_responses)
+            media_resources.parse_tunegenie_data(tunegenie_responses)
+    except Exception as exc:
+        error = repr(exc)
+    wall_time = time.perf_counter() - started
+    loop.close()
+    server.stop()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+
+    return {
+        'case': args.case,
+        'steps': args.steps[0],
+        'wall_time': wall_time,
+        'requests': server.requests,
+        'requests_per_second': server.requests / wall_time if wall_time and server.requests else 0,
+        'bytes': server.bytes_sent,
+        'songs': len(media_resources.music_list),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'error': error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of responses that are a 500')
+    parser.add_argument('--songs', type=int, default=20, help='songs in each synthetic response')
+    parser.add_argument('--recordings', help='directory of recorded responses to replay')
+    parser.add_argument('--parse-workers', type=int, help='processes parsing the responses, none by default')
+    parser.add_argument('--json', action='store_true', help='print the results as json lines')
+    parser.add_argument('--case', choices=CASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args)))
+        return
+
+    if not args.json:
+        print('{:<10} {:>8} {:>10} {:>10} {:>10} {:>12} {:>10} {:>12}  {}'.format(
+            'case', 'steps', 'wall s', 'requests', 'req/s', 'bytes', 'songs', 'peak rss kb', 'error'))
+    for case in args.cases:
+        for steps in args.steps:
+            command = [sys.executable, os.path.abspath(__file__), '--case', case, '--steps', str(steps),
+                       '--latency', str(args.latency), '--jitter', str(args.jitter),
+                       '--error-rate', str(args.error_rate), '--songs', str(args.songs)]
+            if args.recordings:
+                command.extend(['--recordings', args.recordings])
+            if args.parse_workers:
+                command.extend(['--parse-workers', str(args.parse_workers)])
+            output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout.decode('utf-8')
+            result = json.loads(output.strip().splitlines()[-1])
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print('{case:<10} {steps:>8} {wall_time:>10.3f} {requests:>10} {requests_per_second:>10.1f} '
+                      '{bytes:>12} {songs:>10} {peak_rss_kb:>12}  {error}'.format(
+                          **dict(result, error=result['error'] or '')))
+
+
+if __name__ == '__main__':
+    main()
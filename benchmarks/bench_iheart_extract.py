@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_iheart_extract
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compares the CPU time and peak memory per page of the streaming iheart extraction against the BeautifulSoup tree
+walk it replaced
+
+Usage: python benchmarks/bench_iheart_extract.py [saved_page.html ...] [--repeat N] [--songs N]
+
+Without saved pages a synthetic recently played page with --songs entries is used.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmusic.iheart_extract import extract_iheart_page  # noqa: E402
+
+
+def synthetic_page(songs):
+    """ Build a page shaped like the iheart recently played page with the given number of songs """
+
+    entries = ''.join(
+        '<li class="playlist-track-container"><div class="track-art"><img src="https://i.iheart.com/{0}.jpg" '
+        'alt="Song Title {0} - Artist Name {0}"/></div><div class="track-info"><a href="/artist/{0}/">'
+        'Song Title {0}</a><span>Artist Name {0}</span><span class="time">10:{1:02d} AM</span></div></li>'.format(
+            i, i % 60)
+        for i in range(songs))
+    return ''.join([
+        '<!DOCTYPE html><html><head><title>Recently Played</title></head><body>',
+        '<header><img src="/logo.png" alt="STATION_LOGO"/><img alt="iHeartRadio"/></header>',
+        '<ul class="playlist">', entries, '</ul>',
+        '<div class="load-more" data-nextpagetoken="token-{}"></div>'.format(songs),
+        '</body></html>']).encode('utf-8')
+
+
+def beautifulsoup_extract(content):
+    """ The extraction previously done in MediaResources, two full walks of the parsed tree """
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser', from_encoding='utf-8')
+    alts = [each.attrs['alt'] for each in soup.find_all() if 'alt' in each.attrs]
+    tokens = [each.attrs['data-nextpagetoken'] for each in soup.find_all() if 'data-nextpagetoken' in each.attrs]
+    return alts, tokens[0] if tokens else None
+
+
+def measure(extract, content, repeat):
+    """ CPU seconds per page and peak traced bytes of an extraction """
+
+    started = time.process_time()
+    for i in range(repeat):
+        result = extract(content)
+    cpu_time = (time.process_time() - started) / repeat
+
+    tracemalloc.start()
+    extract(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, cpu_time, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', help='saved iheart recently played pages or load_more responses')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--songs', type=int, default=500, help='songs in the synthetic page')
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, 'rb') as page:
+                pages.append((os.path.basename(path), page.read()))
+    else:
+        pages = [('synthetic-{}'.format(args.songs), synthetic_page(args.songs))]
+
+    print('{:<32} {:>10} {:>14} {:>14} {:>12} {:>12}'.format(
+        'page', 'bytes', 'soup ms/page', 'stream ms/page', 'soup peak', 'stream peak'))
+    for name, content in pages:
+        soup_result, soup_time, soup_peak = measure(beautifulsoup_extract, content, args.repeat)
+        stream_result, stream_time, stream_peak = measure(extract_iheart_page, content, args.repeat)
+        if soup_result != stream_result:
+            print('{}: extraction results differ'.format(name))
+        print('{:<32} {:>10} {:>14.2f} {:>14.2f} {:>12} {:>12}'.format(
+            name, len(content), soup_time * 1000, stream_time * 1000, soup_peak, stream_peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_parse
+~~~~~~~~~~~~~~~~~~~~~~
+
+Compares the CPU time and peak memory of parsing decoded cbs and tunegenie responses into Track records straight
+from the json against the box.Box wrapping into [artist, title] lists it replaced
+
+Usage: python benchmarks/bench_parse.py [--responses 10000] [--songs 20] [--repeat 3]
+
+The peak memory is measured while the songs of every response are kept in one list, as the music list of a run is.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmusic.media_resources import MediaResources  # noqa: E402
+from gmusic.normalize import is_branding  # noqa: E402
+
+
+def synthetic_responses(responses, songs):
+    """ Decoded cbs and tunegenie responses shaped like the station apis, with the extra fields they carry """
+
+    cbs = json.dumps({'data': {'recentEvents': [
+        {'artist': 'CBS Artist {}'.format(i), 'title': 'CBS Title {}'.format(i), 'timestamp': 1502226000 + i,
+         'image': {'url': 'http://example.com/{}.jpg'.format(i), 'width': 100, 'height': 100}}
+        for i in range(songs)]}})
+    tunegenie = json.dumps({'response': [
+        {'artist': 'Tunegenie Artist {}'.format(i), 'song': 'Tunegenie Title {}'.format(i),
+         'played_at': '2017-08-08T17:{:02d}:00-05:00'.format(i % 60), 'campaign': {'id': i, 'tags': ['a', 'b']}}
+        for i in range(songs)]})
+    return [json.loads(cbs) for i in range(responses)], [json.loads(tunegenie) for i in range(responses)]
+
+
+def box_parse(cbs_responses, tunegenie_responses):
+    """ The parsing previously done in MediaResources, every response wrapped in a box.Box """
+
+    import box
+
+    music_list = []
+    for response in cbs_responses:
+        box_data = box.Box(response)
+        for each_song in box_data.data.recentEvents:
+            music_list.append([each_song.artist, each_song.title])
+    for response in tunegenie_responses:
+        mbox = box.Box(response)
+        for eachlist in mbox.response:
+            if is_branding(eachlist.artist):
+                continue
+            music_list.append([eachlist.artist, eachlist.song])
+    return music_list
+
+
+def track_parse(cbs_responses, tunegenie_responses):
+    """ The provider parsers filling the music list with Track records """
+
+    media_resources = MediaResources(steps=1)
+    media_resources.parse_cbs_station_data(cbs_responses)
+    media_resources.parse_tunegenie_data(tunegenie_responses)
+    return media_resources.music_list
+
+
+def measure(parse, cbs_responses, tunegenie_responses, repeat):
+    """ CPU seconds per run and peak traced bytes of a parse """
+
+    started = time.process_time()
+    for i in range(repeat):
+        result = parse(cbs_responses, tunegenie_responses)
+    cpu_time = (time.process_time() - started) / repeat
+    del result
+
+    tracemalloc.start()
+    result = parse(cbs_responses, tunegenie_responses)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, cpu_time, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--responses', type=int, default=10000, help='responses of each station type')
+    parser.add_argument('--songs', type=int, default=20, help='songs in each response')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cbs_responses, tunegenie_responses = synthetic_responses(args.responses, args.songs)
+    box_result, box_time, box_peak = measure(box_parse, cbs_responses, tunegenie_responses, args.repeat)
+    track_result, track_time, track_peak = measure(track_parse, cbs_responses, tunegenie_responses, args.repeat)
+    if [tuple(song) for song in box_result] != [tuple(song) for song in track_result]:
+        print('parse results differ')
+
+    print('{:<8} {:>10} {:>12} {:>14}'.format('parser', 'songs', 'cpu s', 'peak bytes'))
+    print('{:<8} {:>10} {:>12.3f} {:>14}'.format('box', len(box_result), box_time, box_peak))
+    print('{:<8} {:>10} {:>12.3f} {:>14}'.format('track', len(track_result), track_time, track_peak))
+
+
+if __name__ == '__main__':
+    main()
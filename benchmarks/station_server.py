@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.station_server
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Local stand-in for the cbslocal, tunegenie and iheart hosts. It serves recorded or synthetic responses with a
+configurable latency, error rate and payload size so that the fetch layer can be measured offline
+
+"""
+
+from random import Random
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+from aiohttp import web
+
+
+class StationServer(object):
+    """
+    aiohttp server replaying station responses, run on its own event loop in a background thread
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, songs_per_response=20, recordings=None,
+                 host='127.0.0.1', port=0, seed=None, etags=False):
+        """
+        :param latency: float seconds added to every response
+        :param jitter: float maximum seconds of random latency added on top of latency
+        :param error_rate: float fraction of requests answered with a 500
+        :param songs_per_response: int songs in each synthetic response
+        :param recordings: string directory with recorded cbs.json, tunegenie.json, iheart.html and
+            iheart_load_more.html responses, synthetic responses are served for the missing ones
+        :param host: string
+        :param port: int, 0 picks a free port
+        :param seed: int seed of the latency and error randomness
+        :param etags: bool send an ETag with every response and answer the matching If-None-Match with a 304
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.songs_per_response = songs_per_response
+        self.host = host
+        self.port = port
+        self.random = Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.etags = etags
+        self.not_modified = 0
+
+        self.bodies = {
+            'cbs': self.synthetic_cbs(),
+            'tunegenie': self.synthetic_tunegenie(),
+            'iheart': self.synthetic_iheart('page'),
+            'iheart_load_more': self.synthetic_iheart('more'),
+        }
+        recorded_files = {'cbs': 'cbs.json', 'tunegenie': 'tunegenie.json', 'iheart': 'iheart.html',
+                          'iheart_load_more': 'iheart_load_more.html'}
+        if recordings:
+            for kind, file_name in recorded_files.items():
+                path = os.path.join(recordings, file_name)
+                if os.path.exists(path):
+                    with open(path, 'rb') as recording:
+                        self.bodies[kind] = recording.read()
+
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def synthetic_cbs(self):
+        events = [{'artist': 'CBS Artist {}'.format(i), 'title': 'CBS Title {}'.format(i)}
+                  for i in range(self.songs_per_response)]
+        return json.dumps({'data': {'recentEvents': events}}).encode('utf-8')
+
+    def synthetic_tunegenie(self):
+        songs = [{'artist': 'Tunegenie Artist {}'.format(i), 'song': 'Tunegenie Title {}'.format(i)}
+                 for i in range(self.songs_per_response)]
+        return json.dumps({'response': songs}).encode('utf-8')
+
+    def synthetic_iheart(self, page):
+        entries = ''.join('<li><img src="/{0}.jpg" alt="iHeart Title {1} {0} - iHeart Artist {0}"/></li>'.format(
+            i, page) for i in range(self.songs_per_response))
+        return ''.join(['<html><body><img alt="STATION_LOGO"/><ul>', entries,
+                        '</ul><div data-nextpagetoken="{}-token"></div></body></html>'.format(page)]).encode('utf-8')
+
+    async def respond(self, kind, content_type, request):
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text='synthetic error')
+        body = self.bodies[kind]
+        headers = {}
+        if self.etags:
+            headers['ETag'] = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if request.headers.get('If-None-Match') == headers['ETag']:
+                self.not_modified += 1
+                return web.Response(status=304, headers=headers)
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type=content_type, headers=headers)
+
+    async def cbs(self, request):
+        return await self.respond('cbs', 'application/json', request)
+
+    async def tunegenie(self, request):
+        return await self.respond('tunegenie', 'application/json', request)
+
+    async def iheart(self, request):
+        return await self.respond('iheart', 'text/html', request)
+
+    async def iheart_load_more(self, request):
+        await request.read()
+        return await self.respond('iheart_load_more', 'text/html', request)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/cbs/{station}/playlist/', self.cbs)
+        app.router.add_get('/tunegenie/{station}/api/v1/brand/nowplaying/', self.tunegenie)
+        app.router.add_get('/iheart/{station}/gmusic/recently-played/', self.iheart)
+        app.router.add_post('/iheart/{station}/api/gmusic/load_more/', self.iheart_load_more)
+        return app
+
+    def start(self):
+        """ Start serving in a background thread, returns once the server accepts connections """
+
+        started = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.runner = web.AppRunner(self.app(), access_log=None)
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, self.host, self.port)
+            self.loop.run_until_complete(site.start())
+            self.port = self.runner.addresses[0][1]
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def configure(self, media_resources, cbs_stations=1, tunegenie_stations=1, iheart_stations=1):
+        """ Point the stations of a MediaResources instance at this server
+
+        :param media_resources: MediaResources
+        :param cbs_stations: int number of cbs stations
+        :param tunegenie_stations: int number of tunegenie stations
+        :param iheart_stations: int number of iheart stations
+        :return: MediaResources
+        """
+
+        radio_stations = media_resources.radio_stations
+        radio_stations['cbs_stations']['urls'] = {
+            'cbs{}'.format(i): '{}/cbs/cbs{}/playlist/'.format(self.base_url, i) for i in range(cbs_stations)}
+        radio_stations['tunegenie']['urls'] = {
+            'tunegenie{}'.format(i): '{}/tunegenie/tunegenie{}/api/v1/brand/nowplaying/'.format(self.base_url, i)
+            for i in range(tunegenie_stations)}
+        radio_stations['iheart']['stations'] = ['iheart{}'.format(i) for i in range(iheart_stations)]
+        radio_stations['iheart']['url'] = ''.join([self.base_url, '/iheart/{}/gmusic/recently-played/'])
+        radio_stations['iheart']['next_url'] = ''.join([self.base_url, '/iheart/{}/api/gmusic/load_more/'])
+        return media_resources
@@ -9,161 +9,291 @@ Main function to initialize and fetch, query, update local and on google playlis
 
 """
 
-from gmusic.media_resources import MediaResources
-from gmusic.fetch_songs import FetchSongs
-from gmusic.retrieve_local_results import QueryUsingPandas
-import box
+from gmusic.media_resources import MediaResources, create_parse_pool
+from gmusic.station_checkpoints import StationCheckpoints
+from gmusic.response_cache import ResponseCache
+from gmusic.response_archive import ResponseArchive
+from gmusic.job_queue import JobQueue
+from gmusic.play_counts import PlayCounts
+from gmusic.metrics import Metrics, NULL_METRICS
+import argparse
 import asyncio
-from halo import Halo
-import datetime
+import os
 
+# pandas, gmusicapi and halo are slow to import, they are only imported by the modes that use them so that a scrape
+# only run starts quickly
 
-def main():
-    """Main function to provide the logic to setup the gmusicapi connection, query radio stations for song information,
-    check the local database if the songs exist and if not, query google gmusic for the song ids and then update a google gmusic
-    playlist with them. Subsequently update the local database with the addded song to the playlist.
 
-    Playlists are managed by the number of songs that they can contain. If a playlist has over 900 songs, we query to see if any
-    other playlists exist that contain < 900 songs and add the songs to them.
+def open_archives(capture=None, replay=None):
+    """ Open the archive raw responses are captured to and the archive replayed instead of the stations
 
+    :param capture: string archive directory to capture to
+    :param replay: string archive directory to replay
+    :return: tuple of ResponseArchive or None
     """
 
-    # first query for gmusic from websites
-    media_resources = MediaResources(steps=3)
+    return (ResponseArchive(capture, 'a') if capture else None,
+            ResponseArchive(replay, 'r') if replay else None)
 
-    # use box so that we can retrieve dictionary fields in a more elegant manner
-    box_radio_stations = box.Box(media_resources.radio_stations)
 
-    spinner = Halo(text='Running asynchronous fetch on websites', spinner='dots')
-    spinner.start()
-    spinner.color = 'magenta'
+def close_archives(*archives):
+    for archive in archives:
+        if archive is not None:
+            archive.close()
 
-    # process async stations first
-    # get the loop for the cbs stations
-    loop = asyncio.get_event_loop()
 
-    # loop over the cbs stations first
-    for radio_station, url in box_radio_stations.cbs_stations.urls.items():
-        # pull parameters from media_resources.radio_stations
-        cbs_params = box_radio_stations.cbs_stations.params
-        box_radio_stations.cbs_stations.headers.Referer = url
-        interval = box_radio_stations.cbs_stations.interval
+def open_job_queue(queue=None):
+    """ Open the job queue the stations are split into for worker processes
+
+    :param queue: string sqlite file of the queue
+    :return: JobQueue or None
+    """
+
+    return JobQueue(queue) if queue else None
+
+
+def open_parse_pool(parse_workers=None):
+    """ Start the processes the responses are decoded and parsed in
+
+    :param parse_workers: int number of processes, responses are parsed on the event loop if not provided
+    :return: concurrent.futures.ProcessPoolExecutor or None
+    """
 
-        playlist_songs_from_cbs_stations = loop.run_until_complete(
-            media_resources.run_loop(loop, headers=box_radio_stations.cbs_stations.headers, url=url, params=cbs_params,
-                                     station='cbs_stations', interval=interval))
+    return create_parse_pool(parse_workers) if parse_workers else None
 
-        media_resources.parse_cbs_station_data(playlist_songs_from_cbs_stations)
+
+def close_parse_pool(parse_pool):
+    if parse_pool is not None:
+        parse_pool.shutdown()
+
+
+def scrape(names=None, providers=None, capture=None, replay=None, queue=None, workers=None, parse_workers=None):
+    """Scrape the radio stations and print the normalized songs, without logging in to google music or loading the
+    library. The station checkpoints are left untouched.
+
+    :param names: collection of station names to scrape, every station if not provided
+    :param providers: tuple of station providers to run, every registered provider if not provided
+    :param capture: string archive directory the raw responses are captured to
+    :param replay: string archive directory replayed instead of scraping the stations
+    :param queue: string sqlite file of a job queue the stations are split into, fetched in the current process if
+        not provided
+    :param workers: int number of local worker processes working the job queue
+    :param parse_workers: int number of processes parsing the responses, parsed on the event loop if not provided
+    """
+
+    from gmusic.normalize import normalize_songs
+
+    capture_archive, replay_archive = open_archives(capture, replay)
+    job_queue = open_job_queue(queue)
+    parse_pool = open_parse_pool(parse_workers)
+    media_resources = MediaResources(steps=3, providers=providers, capture=capture_archive, replay=replay_archive,
+                                     job_queue=job_queue, workers=workers, parse_pool=parse_pool)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(media_resources.run_stations(loop, names=names))
     loop.close()
-    #
-    # # process tunegenie stations next
-    # # get the loop
-    loop_again = asyncio.new_event_loop()
+    close_archives(capture_archive, replay_archive, job_queue)
+    close_parse_pool(parse_pool)
+    for song in normalize_songs(media_resources.music_list):
+        print(song.artist, '-', song.title)
 
-    for radio_station, url in box_radio_stations.tunegenie.urls.items():
-        # parameters are similar to above
-        tunegenie_params = box_radio_stations.tunegenie.params
-        box_radio_stations.tunegenie.headers.Referer = url
-        interval = box_radio_stations.tunegenie.interval
 
-        playlist_songs_from_tunegenie_stations = loop_again.run_until_complete(
-            media_resources.run_loop(loop_again, headers=box_radio_stations.tunegenie.headers, url=url,
-                                     params=tunegenie_params, station='tunegenie', interval=interval))
+def main(names=None, providers=None, capture=None, replay=None, queue=None, workers=None, parse_workers=None,
+         trending=None):
+    """Main function to provide the logic to setup the gmusicapi connection, query radio stations for song information,
+    check the local database if the songs exist and if not, query google gmusic for the song ids and then update a google gmusic
+    playlist with them. Subsequently update the local database with the addded song to the playlist.
 
-        media_resources.parse_tunegenie_data(playlist_songs_from_tunegenie_stations)
-    loop_again.close()
+    Playlists are managed by the number of songs that they can contain. If a playlist has over 900 songs, we query to see if any
+    other playlists exist that contain < 900 songs and add the songs to them.
 
-    spinner.succeed()
-    spinner.color = 'cyan'
-    spinner.text = "Running synchronous fetch on websites"
+    :param names: collection of station names to scrape, every station if not provided
+    :param providers: tuple of station providers to run, every registered provider if not provided
+    :param capture: string archive directory the raw responses are captured to
+    :param replay: string archive directory replayed instead of scraping the stations, to rebuild the library from
+        captured history
+    :param queue: string sqlite file of a job queue the stations are split into, fetched in the current process if
+        not provided
+    :param workers: int number of local worker processes working the job queue
+    :param parse_workers: int number of processes parsing the responses, parsed on the event loop if not provided
+    :param trending: int number of new songs searched for, the ones the stations played the most lately, every new
+        song is searched for if not provided
+    """
 
-    # run synchronous get for the other stations
-    spinner.start()
-    media_resources.run_synchronous_process()
-    spinner.succeed()
+    from gmusic.fetch_songs import FetchSongs
+    from gmusic.retrieve_local_results import QueryUsingPandas
+    from gmusic.search_cache import SearchCache
+    from gmusic.pipeline import SongPipeline
+    from halo import Halo
+
+    # per stage metrics are only collected when GMUSIC_METRICS names the file to export them to, a .prom file for
+    # the Prometheus text format and json otherwise
+    metrics_file = os.environ.get('GMUSIC_METRICS')
+    metrics = Metrics() if metrics_file else NULL_METRICS
+
+    # first query for gmusic from websites
+    # the checkpoints limit each station to the time windows newer than the previous run
+    station_checkpoints = StationCheckpoints()
+    # past windows are served from the response cache and the other responses are only downloaded when they changed
+    response_cache = ResponseCache()
+    capture_archive, replay_archive = open_archives(capture, replay)
+    # with a job queue the (station, window) jobs are fetched and parsed by worker processes, on this machine or on
+    # the machines sharing the queue file
+    job_queue = open_job_queue(queue)
+    # large backfills decode and parse the responses on every core, the event loop only runs the requests
+    parse_pool = open_parse_pool(parse_workers)
+    # the plays of each song per station and hour are rolled up as they are scraped, to rank the new songs
+    play_counts = PlayCounts()
+    media_resources = MediaResources(steps=3, checkpoints=station_checkpoints, metrics=metrics, providers=providers,
+                                     response_cache=response_cache, capture=capture_archive, replay=replay_archive,
+                                     job_queue=job_queue, workers=workers, parse_pool=parse_pool,
+                                     play_counts=play_counts)
 
     # create google api search setup
-    google_music_fetch = FetchSongs()
+    # searches are cached on disk so that songs seen on previous runs do not hit the api again
+    search_cache = SearchCache()
+    google_music_fetch = FetchSongs(search_cache=search_cache, metrics=metrics)
+
+    def save_state():
+        station_checkpoints.save()
+        search_cache.close()
+        print(response_cache.report())
+        response_cache.close()
+        close_archives(capture_archive, replay_archive, job_queue)
+        close_parse_pool(parse_pool)
+        play_counts.close()
+        if metrics_file:
+            metrics.export(metrics_file)
+
+    # load pandas dataframe
+    pandas_init = QueryUsingPandas(load_or_save=None, google_music_json_file=None, dataframe=None, remaining_songs=None,
+                                   new_music_list=None, playlist=None, name=None, song_list=None, library_file=None,
+                                   metrics=metrics)
+    # only the columns needed for the library checks and the playlist sizes are loaded from the library store
+    music_dataframe = pandas_init.load_and_save_pandas_dataframe(load_or_save='load',
+                                                                 columns=['artist', 'title', 'playlist_id'])
+
+    # index the library once so that each song check is a hash lookup instead of a scan of the dataframe
+    library_index = pandas_init.build_library_index(music_dataframe)
+
+    spinner = Halo(text='Running fetch on websites and search on google music', spinner='dots')
+    spinner.start()
+    spinner.color = 'magenta'
+
+    # all cbs, tunegenie and iheart stations are fetched concurrently on one loop sharing a pooled client session
+    # and each scraped song flows through normalization, the library check and the google music search as soon as
+    # it is parsed
+    # with trending only the new songs played the most lately are searched for, which bounds the api calls of a run
+    pipeline = SongPipeline(media_resources, google_music_fetch, library_index, searches_per_second=5,
+                            metrics=metrics, names=names, trending=trending)
+    loop = asyncio.get_event_loop()
+    song_list = loop.run_until_complete(pipeline.run(loop))
+    loop.close()
 
-    # remove duplicates
-    # first convert to set
-    media_set = set(tuple(item) for item in media_resources.music_list)
-    music_list = [list(item) for item in media_set]
+    # the songs that failed to be added on a previous run go first, their windows are behind the checkpoints
+    pending_songs = station_checkpoints.pending_songs()
+    pending_ids = set(each_song_list[2] for each_song_list in pending_songs)
+    song_list = pending_songs + [each_song_list for each_song_list in song_list if each_song_list[2] not in pending_ids]
 
-    if not music_list:
+    if not song_list:
         # log
-        spinner.text = "Unable to retrieve song data from websites"
+        spinner.text = "No new songs found on the websites"
         spinner.fail()
+        save_state()
         exit()
+    spinner.succeed()
 
-    # load pandas dataframe
-    pandas_init = QueryUsingPandas(load_or_save=None, google_music_json_file=None, dataframe=None, remaining_songs=None,
-                                   new_music_list=None, playlist=None, name=None, song_list=None)
-    music_dataframe = pandas_init.load_and_save_pandas_dataframe(load_or_save='load')
-
-    # create a filter to remove words that contain the following
-    myfilter = ['**', '[', ']', '(', ')', '+']
-    song_list = []
-    # check if each song in music_list is in the pandas df
-    for index, each_song in enumerate(music_list):
-        artist, song = each_song[0], each_song[1]
-        song = ' '.join([title for title in song.split(" ") if not any(i in title for i in myfilter)])
-        artist = ' '.join([singer for singer in artist.split(" ") if not any(i in singer for i in myfilter)])
-
-        if '??' in song or '??' in artist:
-            continue
-
-        if pandas_init.check_song_in_pandas_dataframe(dataframe=music_dataframe, artist=artist, song=song):
-            # music_list.pop(index)
-            continue
-
-        # need to save the timestamp as well
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # search for song in google play
-        # print("Searching for nid for song", song, "by", artist)
-        song_nid = google_music_fetch.search_for_songs(artist=artist, title=song)
-        # print("Found nid", song_nid)
-
-        if song_nid:
-            song_list.append([artist, song, song_nid, timestamp])
-        else:
-            # song not found in google play
-            continue
-
-    # now that we have the song_list, we can now query for a playlist to so that we can append it
-    # create dictionaries for each playlist_id where the value for the playlist key will be a list of lists
-    start_index = 0
-    for playlist_info in pandas_init.get_playlist(dataframe=music_dataframe, new_music_list=song_list):
-        song_ids = []
-        if playlist_info and len(playlist_info) == 2:
-            playlist_id, playlist_slots = playlist_info[0], playlist_info[1]
-
-        else:
-            print("Need to log error")
-        print(playlist_id, playlist_slots)
-        # if not song_dict[playlist_id]:
-        #     song_dict[playlist_id].append([])
-
-        for each_song_list in song_list:
-            each_song_list.append(playlist_id)
-
-            song_ids.append(each_song_list[2])
-
-        # now for the final phase. Update the playlist at Play Music with the songids
-        if song_ids:
-            print(google_music_fetch.add_songs_to_gmusic_playlist(playlist_id,
-                                                                  song_ids[start_index:start_index + playlist_slots]))
-            start_index = playlist_slots
+    # now that we have the song_list, we can now plan which playlists the songs go to
+    # partially filled playlists are filled first and new playlists are only created for the remaining songs
+    # the songs are then added to the playlists at Play Music in chunks retried on failure, the songs that failed
+    # are left out of the library and saved with the checkpoints so that the next run adds them first
+    playlist_planner = pandas_init.get_playlist_planner(music_dataframe)
+    planned_songs = song_list
+    song_list = google_music_fetch.add_songs_to_planned_playlists(song_list, playlist_planner, pandas_init.name)
+    added_ids = set(each_song_list[2] for each_song_list in song_list)
+    station_checkpoints.set_pending_songs([each_song_list for each_song_list in planned_songs
+                                           if each_song_list[2] not in added_ids])
 
     print(song_list)
-    # update the pandas_dataframe
-    music_dataframe = QueryUsingPandas.append_to_pandas_dataframe(dataframe=music_dataframe, song_list=song_list)
-    pandas_init.load_and_save_pandas_dataframe(dataframe=music_dataframe, load_or_save='save')
+    # append the new songs to the library store, the existing rows are not rewritten
+    pandas_init.load_and_save_pandas_dataframe(load_or_save='append', song_list=song_list)
+    save_state()
 
     import pickle
     pickle.dump(song_list, open('/tmp/pickle1', 'wb'))
 
 
+def daemon(interval=900, names=None, providers=None):
+    """Long running mode of main. The google music login, the pooled http session, the search cache and the library
+    index are set up once and kept warm, each station is then polled on its own interval and only the plays newer
+    than its checkpoint are fetched, searched for and added to the playlists. SIGINT or SIGTERM stop the polling and
+    save the checkpoints.
+
+    :param interval: int seconds between two polls of a station
+    :param names: collection of station names to poll, every station if not provided
+    :param providers: tuple of station providers to run, every registered provider if not provided
+    """
+
+    from gmusic.fetch_songs import FetchSongs
+    from gmusic.retrieve_local_results import QueryUsingPandas
+    from gmusic.search_cache import SearchCache
+    from gmusic.daemon import GmusicDaemon
+
+    metrics_file = os.environ.get('GMUSIC_METRICS')
+    metrics = Metrics() if metrics_file else NULL_METRICS
+
+    # the checkpoints bound every poll to the windows since the previous one, the steps only matter for the first
+    # poll of a station, which covers the same last 36 hours as main
+    station_checkpoints = StationCheckpoints()
+    media_resources = MediaResources(steps=3, checkpoints=station_checkpoints, metrics=metrics, providers=providers,
+                                     response_cache=ResponseCache())
+
+    search_cache = SearchCache()
+    google_music_fetch = FetchSongs(search_cache=search_cache, metrics=metrics)
+
+    pandas_init = QueryUsingPandas(load_or_save=None, google_music_json_file=None, dataframe=None, remaining_songs=None,
+                                   new_music_list=None, playlist=None, name=None, song_list=None, library_file=None,
+                                   metrics=metrics)
+    music_dataframe = pandas_init.load_and_save_pandas_dataframe(load_or_save='load',
+                                                                 columns=['artist', 'title', 'playlist_id'])
+    library_index = pandas_init.build_library_index(music_dataframe)
+    playlist_planner = pandas_init.get_playlist_planner(music_dataframe)
+    del music_dataframe
+
+    gmusic_daemon = GmusicDaemon(media_resources, google_music_fetch, pandas_init, library_index, playlist_planner,
+                                 station_checkpoints, search_cache=search_cache, metrics=metrics,
+                                 metrics_file=metrics_file, default_interval=interval, searches_per_second=5,
+                                 names=names)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(gmusic_daemon.run(loop))
+    loop.close()
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Add the songs played on the radio stations to google music playlists')
+    parser.add_argument('--daemon', action='store_true', help='keep running and poll the stations on an interval')
+    parser.add_argument('--interval', type=int, default=900, help='seconds between two polls of a station')
+    parser.add_argument('--stations', nargs='+', help='names of the stations to scrape, all of them by default')
+    parser.add_argument('--providers', nargs='+', help='station providers to run, all registered ones by default')
+    parser.add_argument('--scrape-only', action='store_true', help='only scrape and print the songs')
+    parser.add_argument('--capture', metavar='DIR', help='archive the raw station responses to DIR')
+    parser.add_argument('--replay', metavar='DIR', help='replay the responses archived in DIR instead of scraping')
+    parser.add_argument('--queue', metavar='FILE', help='split the stations into jobs of the sqlite job queue FILE')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='local worker processes working the job queue, 0 to leave it to workers started with '
+                             'python -m gmusic.job_queue FILE')
+    parser.add_argument('--parse-workers', type=int, metavar='N',
+                        help='decode and parse the responses in N processes instead of on the event loop')
+    parser.add_argument('--trending', type=int, metavar='N',
+                        help='only search for the N new songs trending the most on the stations')
+    args = parser.parse_args()
+    if args.queue and (args.capture or args.replay):
+        parser.error('--capture and --replay cannot be combined with --queue, the workers fetch the responses')
+    providers = tuple(args.providers) if args.providers else None
+    if args.scrape_only:
+        scrape(names=args.stations, providers=providers, capture=args.capture, replay=args.replay, queue=args.queue,
+               workers=args.workers, parse_workers=args.parse_workers)
+    elif args.daemon:
+        daemon(interval=args.interval, names=args.stations, providers=providers)
+    else:
+        main(names=args.stations, providers=providers, capture=args.capture, replay=args.replay, queue=args.queue,
+             workers=args.workers, parse_workers=args.parse_workers, trending=args.trending)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.daemon
+~~~~~~~~~~~~~
+
+This module runs gmusic as a long running service. The logged in client, the pooled http session and the library
+index are kept warm between polls, every station is polled on its own interval and only its new plays go through the
+pipeline
+
+"""
+
+import asyncio
+import signal
+
+from gmusic.pipeline import RateLimiter, SongPipeline
+
+
+class GmusicDaemon(object):
+    """
+    Polling scheduler running a SongPipeline per station on the station's own interval
+    """
+
+    def __init__(self, media_resources, google_music_fetch, pandas_init, library_index, playlist_planner,
+                 station_checkpoints, search_cache=None, metrics=None, metrics_file=None, default_interval=900,
+                 intervals=None, searches_per_second=None, names=None):
+        """
+        :param media_resources: MediaResources used to scrape the stations
+        :param google_music_fetch: logged in FetchSongs
+        :param pandas_init: QueryUsingPandas used to append the new songs to the library
+        :param library_index: LibraryIndex of the library, kept up to date with the added songs
+        :param playlist_planner: PlaylistPlanner of the library playlists, kept up to date with the added songs
+        :param station_checkpoints: StationCheckpoints saved after every poll and on shutdown
+        :param search_cache: SearchCache closed on shutdown
+        :param metrics: Metrics exported on shutdown
+        :param metrics_file: string file the metrics are exported to
+        :param default_interval: int seconds between two polls of a station
+        :param intervals: dict of station name or station type to seconds between two polls
+        :param searches_per_second: float rate limit of the google music searches
+        :param names: collection of station names to poll, every station of media_resources if not provided
+        """
+
+        self.media_resources = media_resources
+        self.google_music_fetch = google_music_fetch
+        self.pandas_init = pandas_init
+        self.library_index = library_index
+        self.playlist_planner = playlist_planner
+        self.station_checkpoints = station_checkpoints
+        self.search_cache = search_cache
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self.default_interval = default_interval
+        self.intervals = intervals if intervals else {}
+        self.searches_per_second = searches_per_second
+        self.names = names
+        self.stopping = None
+        self.update_lock = None
+        self.rate_limiter = None
+
+    def interval(self, station, name):
+        """ Seconds between two polls of a station, looked up by name first and then by station type """
+
+        return self.intervals.get(name, self.intervals.get(station, self.default_interval))
+
+    def add_new_songs(self, song_list):
+        """ Add the songs found by a poll to the playlists, runs in a worker thread
+
+        :param song_list: list of [artist, title, song id, timestamp] lists
+        :returns list of the song lists that were added
+        """
+
+        return self.google_music_fetch.add_songs_to_planned_playlists(song_list, self.playlist_planner,
+                                                                      self.pandas_init.name)
+
+    async def poll(self, loop, client, station, name):
+        """ Run the pipeline once for a station and add the new songs it found
+
+        :param loop: Asyncio event loop
+        :param client: pooled client session
+        :param station: string station type
+        :param name: string station name
+        :returns coroutine None
+        """
+
+        # the pipelines of every station share one rate limiter so that searches_per_second holds for the daemon
+        pipeline = SongPipeline(self.media_resources, self.google_music_fetch, self.library_index,
+                                rate_limiter=self.rate_limiter, stations=(station,), names=(name,), client=client,
+                                metrics=self.metrics)
+        # the scrape moves the checkpoint of the station before its songs are searched for, it is only saved once
+        # they are pending and put back if the poll fails before, so that the next poll fetches the same windows
+        self.station_checkpoints.hold(name)
+        try:
+            song_list = await pipeline.run(loop)
+        except BaseException:
+            self.station_checkpoints.release(name, keep=False)
+            raise
+        async with self.update_lock:
+            # the songs that failed to be added by a previous poll go first, their windows are behind the checkpoints
+            pending_songs = self.station_checkpoints.pending_songs()
+            song_list = pending_songs + song_list
+            # another station may have added the same songs since the pipeline checked the library
+            song_list = [each_song_list for each_song_list in song_list
+                         if not self.library_index.contains(each_song_list[0], each_song_list[1])]
+            # kept until the insert reports which songs were added, a poll failing midway loses none of them
+            planned_songs = song_list
+            self.station_checkpoints.set_pending_songs(planned_songs)
+            self.station_checkpoints.release(name)
+            if song_list:
+                song_list = await loop.run_in_executor(None, self.add_new_songs, song_list)
+                added_ids = set(each_song_list[2] for each_song_list in song_list)
+                self.station_checkpoints.set_pending_songs([each_song_list for each_song_list in planned_songs
+                                                            if each_song_list[2] not in added_ids])
+                # the library store connection and the index belong to the loop thread, where the other pipelines
+                # read the index
+                self.pandas_init.load_and_save_pandas_dataframe(load_or_save='append', song_list=song_list)
+                self.library_index.add_songs(song_list)
+            self.station_checkpoints.save()
+        print(name, "added", len(song_list), "songs")
+
+    async def poll_station(self, loop, client, station, name):
+        """ Poll a station on its interval until the daemon is stopped """
+
+        interval = self.interval(station, name)
+        while not self.stopping.is_set():
+            try:
+                await self.poll(loop, client, station, name)
+            except Exception as exc:
+                # a failing station is retried on its next poll without stopping the others
+                print(name, "poll failed", repr(exc))
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """ Ask the daemon to stop once the polls in progress are done """
+
+        self.stopping.set()
+
+    def shutdown(self):
+        """ Checkpoint the state of the daemon """
+
+        self.station_checkpoints.save()
+        if self.search_cache is not None:
+            self.search_cache.close()
+        if self.media_resources.response_cache is not None:
+            print(self.media_resources.response_cache.report())
+            self.media_resources.response_cache.close()
+        if self.metrics is not None and self.metrics_file:
+            self.metrics.export(self.metrics_file)
+
+    async def run(self, loop):
+        """ Poll every station until SIGINT or SIGTERM, then checkpoint the state
+
+        :param loop: Asyncio event loop
+        :returns coroutine None
+        """
+
+        self.stopping = asyncio.Event()
+        self.update_lock = asyncio.Lock()
+        self.rate_limiter = RateLimiter(self.searches_per_second)
+        for each_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(each_signal, self.stop)
+        try:
+            async with self.media_resources.create_client(loop) as client:
+                await asyncio.gather(*[self.poll_station(loop, client, station, name)
+                                       for station, name in self.media_resources.station_names()
+                                       if self.names is None or name in self.names])
+        finally:
+            for each_signal in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(each_signal)
+            self.shutdown()
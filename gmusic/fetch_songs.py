@@ -8,9 +8,20 @@ This module runs the main process to fetch the play gmusic songs
 """
 
 from gmusicapi import Mobileclient
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from random import random
 import os
+import time
 import box
 
+from gmusic.search_cache import MISSING
+from gmusic.metrics import NULL_METRICS
+
+
+# result of adding one chunk of songs to a playlist, error is None when the chunk was added
+ChunkResult = namedtuple('ChunkResult', ['playlist_id', 'song_ids', 'added', 'error', 'attempts'])
+
 
 class FetchSongs(object):
     """
@@ -18,15 +29,24 @@ class FetchSongs(object):
          Play Music account
     """
 
-    def __init__(self):
+    def __init__(self, api=None, search_cache=None, metrics=None):
+        """
+        :param api: logged in Mobileclient like object, a new Mobileclient is logged in if not provided
+        :param search_cache: SearchCache used to avoid repeating searches across runs
+        :param metrics: Metrics collecting the api calls and search timings, disabled if not provided
+        """
 
         self.songs = []
         self.nids = []
+        self.search_cache = search_cache
+        self.metrics = metrics if metrics is not None else NULL_METRICS
 
-        os.environ['REQUESTS_CA_BUNDLE'] = '/etc/ssl/certs/ca-certificates.crt'
+        if api is None:
+            os.environ['REQUESTS_CA_BUNDLE'] = '/etc/ssl/certs/ca-certificates.crt'
 
-        self.api = Mobileclient()
-        self.api.login('xxxxxx', 'xxxxx', Mobileclient.FROM_MAC_ADDRESS)
+            api = Mobileclient()
+            api.login('xxxxxx', 'xxxxx', Mobileclient.FROM_MAC_ADDRESS)
+        self.api = api
 
     def add_songs_to_gmusic_playlist(self, playlist_id, song_ids):
         """ Add songs to the GMUSIC API playlist using song ids
@@ -36,9 +56,76 @@ class FetchSongs(object):
         :returns: None
         """
 
+        self.metrics.increment('api_calls')
         return self.api.add_songs_to_playlist(playlist_id, song_ids)
 
+    def add_chunk_to_gmusic_playlist(self, playlist_id, song_ids, retries=3, backoff=1.0):
+        """ Add a chunk of songs to a GMUSIC API playlist, retrying with a jittered exponential backoff
+
+        :param playlist_id: str playlist id
+        :param song_ids: list of strings
+        :param retries: int number of retries after the first attempt
+        :param backoff: float seconds to wait before the first retry
+        :returns ChunkResult
+        """
+
+        error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1) * (0.5 + random()))
+            try:
+                added = self.add_songs_to_gmusic_playlist(playlist_id, song_ids)
+                return ChunkResult(playlist_id, song_ids, added, None, attempt + 1)
+            except Exception as exc:
+                error = exc
+        return ChunkResult(playlist_id, song_ids, None, error, retries + 1)
+
+    def add_songs_to_gmusic_playlists(self, playlist_songs, chunk_size=200, max_workers=4, retries=3, backoff=1.0):
+        """ Bulk add songs to several GMUSIC API playlists
+
+        The song ids of each playlist are split in chunks that are added in order, while the playlists are filled
+        concurrently. A chunk that keeps failing does not stop the other chunks, its result holds the error instead.
+
+        :param playlist_songs: dict playlist id to list of song ids
+        :param chunk_size: int maximum number of songs sent in one call
+        :param max_workers: int number of playlists filled concurrently
+        :param retries: int number of retries of a failed chunk
+        :param backoff: float seconds to wait before the first retry of a chunk
+        :returns list of ChunkResult
+        """
+
+        def add_playlist_chunks(playlist_id, song_ids):
+            return [self.add_chunk_to_gmusic_playlist(playlist_id, song_ids[start:start + chunk_size], retries=retries,
+                                                      backoff=backoff)
+                    for start in range(0, len(song_ids), chunk_size)]
+
+        results = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for playlist_results in executor.map(add_playlist_chunks, playlist_songs.keys(), playlist_songs.values()):
+                results.extend(playlist_results)
+        return results
+
     def search_for_songs(self, artist, title):
+        """ Search for songs in the GMUSIC API, going through the search cache first if there is one
+
+        :param artist: string
+        :param title: string
+        :return song_nid: string
+        """
+
+        with self.metrics.time('search'):
+            if self.search_cache is not None:
+                song_nid = self.search_cache.get(artist, title)
+                if song_nid is MISSING:
+                    self.metrics.increment('cache_misses')
+                    song_nid = self.search_api_for_songs(artist, title)
+                    self.search_cache.set(artist, title, song_nid)
+                else:
+                    self.metrics.increment('cache_hits')
+                return song_nid
+            return self.search_api_for_songs(artist, title)
+
+    def search_api_for_songs(self, artist, title):
         """ Search for songs in the GMUSIC API
 
         :param artist: string
@@ -47,6 +134,7 @@ class FetchSongs(object):
         """
 
         song_nid = None
+        self.metrics.increment('api_calls')
         search_content = self.api.search(''.join([artist, ' ', title]))
         for each_song in search_content['song_hits']:
             song_detail = box.Box(each_song['track'])
@@ -55,6 +143,43 @@ class FetchSongs(object):
                 break
         return song_nid
 
+    def add_songs_to_planned_playlists(self, song_list, playlist_planner, name):
+        """ Add songs to the playlists assigned by a PlaylistPlanner, creating the new playlists it asks for
+
+        The playlist id is appended to each added song list and the planner counts are updated with the songs that
+        were added. Songs whose chunk failed are left out of the returned list, the caller keeps them for the next run
+        with StationCheckpoints.set_pending_songs since their stations are not scraped again.
+
+        :param song_list: list of [artist, title, song id, timestamp] lists
+        :param playlist_planner: PlaylistPlanner
+        :param name: string name prefix of the new playlists
+        :returns list of the song lists that were added
+        """
+
+        new_playlists = 0
+        playlist_songs = {}
+        for allocation in playlist_planner.plan(len(song_list)):
+            playlist_id = allocation.playlist_id
+            if allocation.new:
+                new_playlists += 1
+                playlist_id = self.create_gmusic_playlist('-'.join([name, str(new_playlists)]))
+            allocated_songs = song_list[allocation.start:allocation.stop]
+            for each_song_list in allocated_songs:
+                each_song_list.append(playlist_id)
+            playlist_songs[playlist_id] = [each_song_list[2] for each_song_list in allocated_songs]
+            print(playlist_id, len(playlist_songs[playlist_id]))
+
+        failed_song_ids = set()
+        for chunk_result in self.add_songs_to_gmusic_playlists(playlist_songs):
+            if chunk_result.error is not None:
+                print("Failed to add", len(chunk_result.song_ids), "songs to", chunk_result.playlist_id,
+                      chunk_result.error)
+                failed_song_ids.update(chunk_result.song_ids)
+            else:
+                playlist_planner.add(chunk_result.playlist_id, len(chunk_result.song_ids))
+
+        return [each_song_list for each_song_list in song_list if each_song_list[2] not in failed_song_ids]
+
     def get_playlists_length(self, api_content):
         """ Get size of GMUSIC playlists in terms of number of songs
 
@@ -83,9 +208,9 @@ class FetchSongs(object):
         else:
             return None
 
-    @classmethod
     def create_gmusic_playlist(self, name):
         """ Create GMUSIC playlist
         :param name: string name of playlist
         :return: string success or fail"""
+        self.metrics.increment('api_calls')
         return self.api.create_playlist(name)
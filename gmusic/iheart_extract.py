@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.iheart_extract
+~~~~~~~~~~~~~~~~~~~~~
+
+This module extracts the song details and the next page token from iheart pages in a single streaming pass, without
+building the document tree
+
+"""
+
+from html.parser import HTMLParser
+import codecs
+
+
+class IHeartExtractor(HTMLParser):
+    """
+    Event based parser collecting the alt attributes and the first data-nextpagetoken attribute of a page.
+
+    Content can be fed in chunks as it is downloaded, only the collected attribute values are kept in memory.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.alts = []
+        self.token = None
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name == 'alt':
+                self.alts.append(value if value is not None else '')
+            elif name == 'data-nextpagetoken' and self.token is None:
+                self.token = value if value is not None else ''
+
+    def feed_bytes(self, chunk):
+        """ Feed a chunk of utf-8 encoded content, chunks may split multi byte characters
+
+        :param chunk: bytes
+        :return: None
+        """
+
+        self.feed(self.decoder.decode(chunk))
+
+    def close(self):
+        self.feed(self.decoder.decode(b'', final=True))
+        super().close()
+
+
+def extract_iheart_page(content):
+    """ Extract the alt attributes and the next page token of an iheart page
+
+    :param content: bytes or string html content
+    :return: tuple of list of alt strings and string token for the next page, None if there is no next page
+    """
+
+    extractor = IHeartExtractor()
+    if isinstance(content, bytes):
+        extractor.feed_bytes(content)
+    else:
+        extractor.feed(content)
+    extractor.close()
+    return extractor.alts, extractor.token
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.job_queue
+~~~~~~~~~~~~~~~~
+
+This module distributes the scraping over several processes. MediaResources turns its (station, time window) units
+into jobs of a sqlite backed queue, worker processes claim the jobs under a lease, fetch and parse them and write the
+songs back to the queue. Jobs whose lease expired, because their worker crashed or hung, are claimed again.
+
+Workers on other machines can share a queue file on a shared file system:
+
+    python -m gmusic.job_queue /shared/gmusic_jobs.sqlite --concurrency 8
+
+"""
+
+from collections import namedtuple
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+
+
+# a claimed job, since and until are None for the stations that are not fetched by time window
+Job = namedtuple('Job', ['id', 'batch', 'provider', 'station', 'since', 'until', 'attempts'])
+
+
+class JobQueue(object):
+    """
+    Sqlite backed queue of scrape jobs and of the songs they produced, grouped by batch.
+
+    A batch holds the station definitions it was enqueued with so that every worker fetches the same urls. A claimed
+    job is leased for lease seconds, a job is failed for good once it was claimed max_attempts times.
+    """
+
+    def __init__(self, queue_file=None, lease=300.0, max_attempts=3):
+        """
+        :param queue_file: string sqlite file, ~/.gmusic/jobs.sqlite if not provided
+        :param lease: float seconds a worker has to finish a claimed job
+        :param max_attempts: int number of claims of a job before it is failed
+        """
+
+        if queue_file:
+            self.queue_file = queue_file
+        else:
+            self.queue_file = os.path.expanduser('~/.gmusic/jobs.sqlite')
+
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(self.queue_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # transactions are explicit so that claiming a job is a single write transaction across processes
+        self.connection = sqlite3.connect(self.queue_file, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS batches (batch TEXT PRIMARY KEY, config TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                'id INTEGER PRIMARY KEY, batch TEXT NOT NULL, provider TEXT NOT NULL, '
+                                'station TEXT NOT NULL, since TEXT, until TEXT, status TEXT NOT NULL, worker TEXT, '
+                                'lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                'id INTEGER PRIMARY KEY, batch TEXT NOT NULL, job_id INTEGER NOT NULL, '
+                                'station TEXT NOT NULL, artist TEXT NOT NULL, title TEXT NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_batch ON results (batch, id)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_job ON results (job_id, id)')
+
+    def transaction(self, statements):
+        """ Run statements in one write transaction
+
+        :param statements: function called with the connection
+        :return: the result of statements
+        """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(self.connection)
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return result
+
+    def add_batch(self, config, jobs):
+        """ Enqueue a batch of jobs
+
+        :param config: dict provider name to its station definitions, as in MediaResources.radio_stations
+        :param jobs: iterable of (provider, station, since, until) tuples
+        :return: string batch id
+        """
+
+        batch = '{}-{}-{}'.format(socket.gethostname(), os.getpid(), time.time())
+
+        def statements(connection):
+            connection.execute('INSERT INTO batches (batch, config) VALUES (?, ?)', (batch, json.dumps(config)))
+            connection.executemany("INSERT INTO jobs (batch, provider, station, since, until, status) "
+                                   "VALUES (?, ?, ?, ?, ?, 'pending')",
+                                   ((batch, provider, station, since, until) for provider, station, since, until
+                                    in jobs))
+
+        self.transaction(statements)
+        return batch
+
+    def batch_config(self, batch):
+        row = self.connection.execute('SELECT config FROM batches WHERE batch = ?', (batch,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def claim(self, worker, limit=1):
+        """ Claim pending jobs, the jobs whose lease expired being pending again
+
+        :param worker: string worker id
+        :param limit: int maximum number of jobs claimed
+        :return: list of Job
+        """
+
+        now = time.time()
+
+        def statements(connection):
+            connection.execute("UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                               "worker = NULL, error = coalesce(error, 'lease expired') "
+                               "WHERE status = 'claimed' AND lease_expires < ?", (self.max_attempts, now))
+            rows = connection.execute("SELECT id, batch, provider, station, since, until, attempts FROM jobs "
+                                      "WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)).fetchall()
+            connection.executemany("UPDATE jobs SET status = 'claimed', worker = ?, lease_expires = ?, "
+                                   "attempts = attempts + 1 WHERE id = ?",
+                                   ((worker, now + self.lease, row[0]) for row in rows))
+            return [Job(*row[:6], attempts=row[6] + 1) for row in rows]
+
+        return self.transaction(statements)
+
+    def complete(self, job, worker, songs):
+        """ Write the songs of a job back and mark it done, unless its lease was lost to another worker
+
+        :param job: Job
+        :param worker: string worker id
+        :param songs: list of (artist, title) sequences
+        :return: bool True if the job was still held by the worker
+        """
+
+        def statements(connection):
+            updated = connection.execute("UPDATE jobs SET status = 'done', lease_expires = NULL "
+                                         "WHERE id = ? AND status = 'claimed' AND worker = ?", (job.id, worker))
+            if not updated.rowcount:
+                return False
+            connection.executemany('INSERT INTO results (batch, job_id, station, artist, title) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   ((job.batch, job.id, job.station, song[0], song[1]) for song in songs))
+            return True
+
+        return self.transaction(statements)
+
+    def fail(self, job, worker, error):
+        """ Release a job that failed, it is failed for good after max_attempts claims
+
+        :param job: Job
+        :param worker: string worker id
+        :param error: string
+        :return: None
+        """
+
+        self.transaction(lambda connection: connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, "
+            "lease_expires = NULL, error = ? WHERE id = ? AND status = 'claimed' AND worker = ?",
+            (self.max_attempts, error, job.id, worker)))
+
+    def unfinished(self, batch=None):
+        """ Number of pending and claimed jobs
+
+        :param batch: string batch id, every batch if not provided
+        :return: int
+        """
+
+        if batch is None:
+            return self.connection.execute("SELECT count(*) FROM jobs WHERE status IN ('pending', 'claimed')"
+                                           ).fetchone()[0]
+        return self.connection.execute("SELECT count(*) FROM jobs WHERE batch = ? AND status IN ('pending', 'claimed')",
+                                       (batch,)).fetchone()[0]
+
+    def collect(self, batch, limit=100):
+        """ Songs of the jobs of a batch done since the previous call, the jobs are marked collected
+
+        :param batch: string batch id
+        :param limit: int maximum number of jobs
+        :return: list of (station, since, until, list of (artist, title) tuples) tuples, one per job
+        """
+
+        def statements(connection):
+            jobs = connection.execute("SELECT id, station, since, until FROM jobs WHERE batch = ? AND status = 'done' "
+                                      "ORDER BY id LIMIT ?", (batch, limit)).fetchall()
+            collected = [(station, since, until,
+                          connection.execute('SELECT artist, title FROM results WHERE job_id = ? ORDER BY id',
+                                             (job_id,)).fetchall())
+                         for job_id, station, since, until in jobs]
+            connection.executemany("UPDATE jobs SET status = 'collected' WHERE id = ?", ((job[0],) for job in jobs))
+            return collected
+
+        return self.transaction(statements)
+
+    def failed_windows(self, batch):
+        """ Time windows of a batch that failed for good
+
+        :param batch: string batch id
+        :return: dict station name to list of (since, until) tuples
+        """
+
+        failed = {}
+        for station, since, until in self.connection.execute(
+                "SELECT station, since, until FROM jobs WHERE batch = ? AND status = 'failed' AND since IS NOT NULL",
+                (batch,)):
+            failed.setdefault(station, []).append((since, until))
+        return failed
+
+    def failed_stations(self, batch):
+        """ Stations of a batch whose job failed for good, the stations that are not fetched by time window
+
+        :param batch: string batch id
+        :return: dict station name to the error of its job
+        """
+
+        return dict(self.connection.execute("SELECT station, error FROM jobs WHERE batch = ? AND status = 'failed' "
+                                            "AND since IS NULL ORDER BY id", (batch,)).fetchall())
+
+    def fail_batch(self, batch, error):
+        """ Fail the pending and claimed jobs of a batch for good, when no worker is left to run them
+
+        :param batch: string batch id
+        :param error: string
+        :return: None
+        """
+
+        self.transaction(lambda connection: connection.execute(
+            "UPDATE jobs SET status = 'failed', worker = NULL, lease_expires = NULL, error = ? "
+            "WHERE batch = ? AND status IN ('pending', 'claimed')", (error, batch)))
+
+    def purge(self, batch):
+        """ Remove a batch, its jobs and its results once they were read """
+
+        self.transaction(lambda connection: [
+            connection.execute('DELETE FROM {} WHERE batch = ?'.format(table), (batch,))
+            for table in ('results', 'jobs', 'batches')])
+
+    def close(self):
+        self.connection.close()
+
+
+async def work(job_queue, worker, concurrency=8, poll=1.0, exit_when_idle=True, response_cache=None):
+    """ Claim, fetch and parse jobs until the queue is empty
+
+    :param job_queue: JobQueue
+    :param worker: string worker id
+    :param concurrency: int number of jobs fetched at once
+    :param poll: float seconds between two claims when no job is pending
+    :param exit_when_idle: bool return once no job is pending or claimed, keep polling otherwise
+    :param response_cache: ResponseCache the jobs are fetched through, disabled if not provided
+    :returns coroutine int number of jobs done
+    """
+
+    from gmusic.media_resources import MediaResources
+
+    loop = asyncio.get_event_loop()
+    resources = {}
+    done = 0
+
+    def media_resources(batch):
+        # the workers fetch with the station definitions the batch was enqueued with
+        if batch not in resources:
+            config = job_queue.batch_config(batch)
+            resources[batch] = MediaResources(steps=1, providers=tuple(config), response_cache=response_cache)
+            resources[batch].radio_stations.update(config)
+        return resources[batch]
+
+    async def run_job(client, job):
+        provider = media_resources(job.batch).provider(job.provider)
+        return await provider.fetch_window(loop, client, job.station, job.since, job.until)
+
+    async with MediaResources(steps=1).create_client(loop) as client:
+        while True:
+            jobs = job_queue.claim(worker, concurrency)
+            if not jobs:
+                if exit_when_idle and not job_queue.unfinished():
+                    return done
+                await asyncio.sleep(poll)
+                continue
+            results = await asyncio.gather(*[run_job(client, job) for job in jobs], return_exceptions=True)
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    job_queue.fail(job, worker, repr(result))
+                elif job_queue.complete(job, worker, result):
+                    done += 1
+
+
+def run_worker(queue_file, worker=None, concurrency=8, poll=1.0, exit_when_idle=True, response_cache_file=None,
+               lease=300.0, max_attempts=3):
+    """ Run a worker process on a queue file
+
+    :param queue_file: string sqlite file of the queue
+    :param worker: string worker id, host name and process id if not provided
+    :param concurrency: int number of jobs fetched at once
+    :param poll: float seconds between two claims when no job is pending
+    :param exit_when_idle: bool exit once no job is pending or claimed
+    :param response_cache_file: string sqlite file of a ResponseCache shared with the other workers
+    :param lease: float seconds the worker has to finish a claimed job, see JobQueue
+    :param max_attempts: int number of claims of a job before it is failed
+    :return: int number of jobs done
+    """
+
+    from gmusic.response_cache import ResponseCache
+
+    worker = worker if worker else '{}-{}'.format(socket.gethostname(), os.getpid())
+    job_queue = JobQueue(queue_file, lease, max_attempts)
+    # every write is committed so that the workers sharing the cache do not hold its lock
+    response_cache = ResponseCache(response_cache_file, commit_every=1) if response_cache_file else None
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(work(job_queue, worker, concurrency, poll, exit_when_idle, response_cache))
+    finally:
+        loop.close()
+        job_queue.close()
+        if response_cache is not None:
+            print(worker, response_cache.report())
+            response_cache.close()
+
+
+def start_worker(job_queue, concurrency=8, response_cache_file=None):
+    """ Start a local worker process
+
+    :param job_queue: JobQueue whose file, lease and attempts the worker uses
+    :param concurrency: int number of jobs the process fetches at once
+    :param response_cache_file: string sqlite file of a ResponseCache shared with the other workers
+    :return: multiprocessing.Process
+    """
+
+    # spawned rather than forked, the parent runs an event loop and open sqlite connections
+    context = multiprocessing.get_context('spawn')
+    worker = context.Process(target=run_worker, args=(job_queue.queue_file,),
+                             kwargs={'concurrency': concurrency, 'response_cache_file': response_cache_file,
+                                     'lease': job_queue.lease, 'max_attempts': job_queue.max_attempts},
+                             daemon=True)
+    worker.start()
+    return worker
+
+
+def start_workers(job_queue, processes, concurrency=8, response_cache_file=None):
+    """ Start local worker processes
+
+    :param job_queue: JobQueue whose file, lease and attempts the workers use
+    :param processes: int number of processes
+    :param concurrency: int number of jobs each process fetches at once
+    :param response_cache_file: string sqlite file of a ResponseCache shared with the workers
+    :return: list of multiprocessing.Process
+    """
+
+    return [start_worker(job_queue, concurrency, response_cache_file) for i in range(processes)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a gmusic scrape worker on a shared job queue')
+    parser.add_argument('queue_file', help='sqlite file of the job queue')
+    parser.add_argument('--concurrency', type=int, default=8, help='jobs fetched at once')
+    parser.add_argument('--poll', type=float, default=1.0, help='seconds between two claims when idle')
+    parser.add_argument('--forever', action='store_true', help='keep polling when the queue is empty')
+    parser.add_argument('--response-cache', metavar='FILE', help='fetch through the sqlite response cache FILE')
+    parser.add_argument('--lease', type=float, default=300.0, help='seconds to finish a claimed job')
+    parser.add_argument('--max-attempts', type=int, default=3, help='claims of a job before it is failed')
+    args = parser.parse_args()
+    print(run_worker(args.queue_file, concurrency=args.concurrency, poll=args.poll,
+                     exit_when_idle=not args.forever, response_cache_file=args.response_cache, lease=args.lease,
+                     max_attempts=args.max_attempts), "jobs done")
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.library_index
+~~~~~~~~~~~~~~~~~~~~
+
+This module provides an in-memory index over the local music library so that songs can be checked for
+without scanning the whole Pandas DataFrame
+
+"""
+
+from collections import defaultdict
+
+
+def normalize_key(value):
+    """ Normalize an artist or title for index lookups
+
+    :param value: string
+    :return: string casefolded value with whitespace collapsed
+    """
+
+    if not isinstance(value, str):
+        return ''
+    return ' '.join(value.casefold().split())
+
+
+class LibraryIndex(object):
+    """
+    Hash and n-gram index over (artist, title) pairs in the library.
+
+    Exact matches are resolved with a single dictionary lookup. Substring matches, which is what
+    QueryUsingPandas.check_song_in_pandas_dataframe has always relied on, are resolved by intersecting the
+    n-gram posting lists of the query and only verifying the few candidate rows that survive.
+    """
+
+    def __init__(self, ngram=3):
+        self.ngram = ngram
+        self.keys = []
+        self.key_ids = {}
+        self.artist_grams = defaultdict(set)
+        self.title_grams = defaultdict(set)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_dataframe(cls, dataframe, ngram=3):
+        """ Build an index from the artist and title columns of a library DataFrame
+
+        :param dataframe: pandas dataframe
+        :param ngram: int size of the substring index grams
+        :return: LibraryIndex
+        """
+
+        index = cls(ngram=ngram)
+        index.add_songs(zip(dataframe.artist, dataframe.title))
+        return index
+
+    def grams(self, value):
+        """ Split a normalized value into its set of n-grams """
+
+        return {value[i:i + self.ngram] for i in range(len(value) - self.ngram + 1)}
+
+    def add_song(self, artist, title):
+        """ Add a single song to the index
+
+        :param artist: string
+        :param title: string
+        :return: None
+        """
+
+        key = (normalize_key(artist), normalize_key(title))
+        if key in self.key_ids:
+            return
+        key_id = len(self.keys)
+        self.keys.append(key)
+        self.key_ids[key] = key_id
+        for gram in self.grams(key[0]):
+            self.artist_grams[gram].add(key_id)
+        for gram in self.grams(key[1]):
+            self.title_grams[gram].add(key_id)
+
+    def add_songs(self, songs):
+        """ Add songs to the index
+
+        :param songs: iterable of sequences whose first two items are artist and title
+        :return: None
+        """
+
+        for each_song in songs:
+            self.add_song(each_song[0], each_song[1])
+
+    def candidates(self, postings, value):
+        """ Ids of songs whose indexed value could contain the query value, or None if every song could """
+
+        query_grams = self.grams(value)
+        if not query_grams:
+            return None
+        lists = sorted((postings.get(gram, ()) for gram in query_grams), key=len)
+        if not lists[0]:
+            return set()
+        found = set(lists[0])
+        for each_list in lists[1:]:
+            found &= each_list
+            if not found:
+                break
+        return found
+
+    def contains(self, artist, title):
+        """ Check if a song whose artist and title contain the given artist and title is in the index
+
+        :param artist: string
+        :param title: string
+        :return: bool
+        """
+
+        return self.contains_key((normalize_key(artist), normalize_key(title)))
+
+    def contains_key(self, key):
+        """ Same as contains for an (artist, title) key that is already normalized
+
+        :param key: tuple of normalized artist and title
+        :return: bool
+        """
+
+        artist, title = key
+        if key in self.key_ids:
+            return True
+
+        artist_ids = self.candidates(self.artist_grams, artist)
+        title_ids = self.candidates(self.title_grams, title)
+        if artist_ids is None and title_ids is None:
+            key_ids = range(len(self.keys))
+        elif artist_ids is None:
+            key_ids = title_ids
+        elif title_ids is None:
+            key_ids = artist_ids
+        else:
+            key_ids = artist_ids & title_ids
+
+        for key_id in key_ids:
+            key_artist, key_title = self.keys[key_id]
+            if artist in key_artist and title in key_title:
+                return True
+        return False
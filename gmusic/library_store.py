@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.library_store
+~~~~~~~~~~~~~~~~~~~~
+
+This module provides an append only sqlite store for the local music library, replacing the json file that had to
+be read and rewritten whole on every run
+
+"""
+
+import os
+import sqlite3
+import pandas as pd
+
+
+class LibraryStore(object):
+    """
+    Append only store of the songs added to the playlists, loaded into a Pandas DataFrame one column set at a time
+    """
+
+    columns = ['artist', 'title', 'nid', 'timestamp', 'playlist_id']
+
+    def __init__(self, library_file):
+        self.library_file = library_file
+
+        directory = os.path.dirname(self.library_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.library_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS library ('
+                                'artist TEXT, title TEXT, nid TEXT, timestamp TEXT, playlist_id TEXT)')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM library').fetchone()[0]
+
+    def migrate_from_json(self, json_file):
+        """ One time import of the json library written by DataFrame.to_json, skipped once the store has rows
+
+        :param json_file: string path to the json library
+        :return: int number of rows imported
+        """
+
+        if len(self) or not os.path.exists(json_file):
+            return 0
+        dataframe = pd.read_json(json_file, convert_dates=False)
+        dataframe = dataframe.reindex(columns=self.columns)
+        rows = dataframe.astype(object).where(dataframe.notnull(), None).values.tolist()
+        return self.append(rows)
+
+    def append(self, song_list):
+        """ Append songs to the store without rewriting the existing rows
+
+        :param song_list: list of [artist, title, nid, timestamp, playlist_id] lists
+        :return: int number of rows appended
+        """
+
+        rows = [list(each_song[:len(self.columns)]) + [None] * (len(self.columns) - len(each_song))
+                for each_song in song_list]
+        with self.connection:
+            self.connection.executemany('INSERT INTO library (artist, title, nid, timestamp, playlist_id) '
+                                        'VALUES (?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def load(self, columns=None):
+        """ Load the library into a Pandas DataFrame
+
+        :param columns: list of column names to load, every column if not provided
+        :return: pandas dataframe
+        """
+
+        columns = [column for column in columns if column in self.columns] if columns else self.columns
+        return pd.read_sql_query('SELECT {} FROM library ORDER BY rowid'.format(', '.join(columns)), self.connection)
+
+    def close(self):
+        self.connection.close()
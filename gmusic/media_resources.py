@@ -4,17 +4,36 @@
 gmusic.media_resources
 ~~~~~~~~~~~~~~~~~~~~~~
 
-This module queries various radio stations to gather recently played songs on their playlists
+This module queries various radio stations to gather recently played songs on their playlists, through the station
+providers of gmusic.providers
 
 """
 
 from datetime import datetime, timedelta
-from random import randint
+from random import random
+from urllib.parse import urlsplit
 import asyncio
-import aiohttp
-import requests
-from bs4 import BeautifulSoup
-import box
+import json
+import multiprocessing
+import time
+from gmusic.metrics import NULL_METRICS
+from gmusic.resilience import CircuitBreaker, CircuitOpenError, FetchError, check_status
+from gmusic.providers import PROVIDERS, Track, WindowedJsonProvider, get_provider, parse_body, \
+    unpack_tracks
+from gmusic.window_planner import WindowPlanner
+
+
+def create_parse_pool(processes=None):
+    """ Process pool decoding and parsing the responses of MediaResources off the event loop
+
+    :param processes: int number of processes, the number of cores if not provided
+    :returns concurrent.futures.ProcessPoolExecutor
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # spawned rather than forked, the parent runs an event loop and background threads
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
 
 
 class MediaResources(object):
@@ -22,7 +41,11 @@ class MediaResources(object):
     Main class that queries for songs
     """
 
-    def __init__(self, timestamp=None, steps=None):
+    def __init__(self, timestamp=None, steps=None, connection_limit=None, connection_limit_per_host=None,
+                 max_in_flight=None, checkpoints=None, metrics=None, providers=None, response_cache=None,
+                 lookahead=None, capture=None, replay=None, retries=None, backoff=None, timeout=None,
+                 breaker_threshold=None, breaker_reset=None, job_queue=None, workers=None, parse_pool=None,
+                 play_counts=None):
         if not steps:
             self.steps = 50000
         else:
@@ -34,134 +57,129 @@ class MediaResources(object):
             self.timestamp = None
         self.music_list = []
 
-        self.radio_stations = {
-            'cbs_stations': {
-                'params':
-                    [['action', 'playlist'], ['type', 'json'], ['before']]
-                ,
-                'headers': {
-                    'DNT': '1',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Accept-Language': 'en-US,en;q=0.8',
-                    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.90 Safari/537.36',
-                    'Accept': '*/*',
-                    'Referer': 'http://{}.cbslocal.com/playlist',
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'Connection': 'keep-alive',
-                },
-                'urls': {
-                    'wxrt': 'http://wxrt.cbslocal.com/playlist/',
-                    'x1075lasvegas': 'http://x1075.cbslocal.com/playlist',
-                    'kroq': 'http://www.roq.com/playlist/',
-                    'live105': 'http://www.live.com/playlist/',
-                },
-                'interval': self.steps * 4,
-            },
-            'tunegenie': {
-                'params': [['since', '2017-08-08T17:00:00-05:00'], ['until', '2017-08-08T18:59:59-05:00']],
-                'headers': {
-                    'DNT': '1',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Accept-Language': 'en-US,en;q=0.8',
-                    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36',
-                    'Accept': '*/*',
-                    'Referer': 'http://{}.tunegenie.com/onair/',
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'Connection': 'keep-alive',
-                },
-                'urls': {
-                    'wwyy': 'http://wwyy.tunegenie.com/api/v1/brand/nowplaying/',
-                    'wkqx': 'http://wkqx.tunegenie.com/api/v1/brand/nowplaying/'
-                },
-                'interval': self.steps * 4,
-            },
-            'iheart': {
-                'stations': ['star1019', 'dc101'],
-                # 'stations': ['dc101'],
-
-                'data':
-                    [['nextPageToken', 'token'], ['template', 'playlist'], ['offset', '0'],
-                     ['limit', '150000'], ],
-                'headers': {
-                    'DNT': '1',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Accept-Language': 'en-US,en;q=0.8',
-                    'Upgrade-Insecure-Requests': '1',
-                    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                    'Cache-Control': 'max-age=0',
-                    'Connection': 'keep-alive',
-                },
-                'next_headers': {
-                    'origin': 'https://{}.iheart.com',
-                    'accept-encoding': 'gzip, deflate, br',
-                    'accept-language': 'en-US,en;q=0.8',
-                    'x-requested-with': 'XMLHttpRequest',
-                    'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36',
-                    'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                    'accept': 'text/html, */*; q=0.01',
-                    'referer': 'https://{}.iheart.com/gmusic/recently-played/',
-                    'dnt': '1',
-                },
-                'url': 'https://{}.iheart.com/gmusic/recently-played/',
-                'next_url': 'https://{}.iheart.com/api/gmusic/load_more/'
-            }
-        }
-
-    def get_iso_time(self, interval):
-
-        now = datetime.now()
-        for i in range(0, self.steps):
-            t = now.replace(microsecond=0) - timedelta(hours=interval, minutes=randint(0, 9))
-            yield t.isoformat()
-            now = t
-
-    def wrapper(self, func, interval):
-        """ Coroutine wrapper"""
-
-        yield from func(interval)
+        # caps for the pooled connections shared by all the async stations
+        self.connection_limit = connection_limit if connection_limit else 100
+        self.connection_limit_per_host = connection_limit_per_host if connection_limit_per_host else 10
+
+        # cap on the requests a streaming run keeps in flight per station, which bounds its memory use
+        self.max_in_flight = max_in_flight if max_in_flight else 100
+
+        # windows a streaming run plans ahead of the responses it has parsed
+        self.lookahead = lookahead if lookahead else 8
+
+        # retries of a failed request with a jittered exponential backoff, and the timeout of each attempt
+        self.retries = retries if retries is not None else 3
+        self.backoff = backoff if backoff is not None else 0.5
+        self.timeout = timeout if timeout else 30.0
+
+        # circuit breaker of each host, opened by breaker_threshold consecutive failures for breaker_reset seconds
+        self.breaker_threshold = breaker_threshold if breaker_threshold else 5
+        self.breaker_reset = breaker_reset if breaker_reset else 60.0
+        self.breakers = {}
+
+        # StationCheckpoints store used to only fetch the windows newer than the previous run
+        self.checkpoints = checkpoints
+
+        # Metrics collecting the per station timings and counters, disabled by default
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+
+        # ResponseCache serving the past windows and revalidating the other responses, disabled by default
+        self.response_cache = response_cache
+
+        # ResponseArchive the raw responses are captured to, and ResponseArchive replayed instead of the stations
+        self.capture_archive = capture
+        self.replay_archive = replay
+
+        # JobQueue the stations are split into for worker processes, and the number of local workers to start,
+        # none when the queue is worked by processes started elsewhere
+        self.job_queue = job_queue
+        self.workers = workers if workers is not None else 0
+
+        # executor from create_parse_pool the responses are decoded and parsed in, on the event loop if not provided
+        self.parse_pool = parse_pool
+
+        # PlayCounts rolling up the plays of each song per station as they are scraped, disabled by default
+        self.play_counts = play_counts
+
+        # station providers to run, every registered provider by default
+        provider_names = providers if providers else tuple(PROVIDERS)
+        self.providers = {name: get_provider(name)(self) for name in provider_names}
+        self.radio_stations = {name: provider.default_config(self.steps) for name, provider in self.providers.items()}
+
+    def provider(self, station):
+        """ The provider running a station type
+
+        :param station: string station type, the provider name
+        :return: StationProvider
+        """
+
+        return self.providers[station]
 
     def parse_cbs_station_data(self, data):
         """ Adds songs to list for cbs stations """
 
+        parse = self.provider('cbs_stations').parse
         for each_data in data:
-            box_data = box.Box(each_data)
-            for each_song in box_data.data.recentEvents:
-                self.music_list.append([each_song.artist, each_song.title])
+            self.music_list.extend(parse(each_data))
 
     def parse_tunegenie_data(self, data):
         """ Adds songs to list for tunegenie stations"""
 
+        parse = self.provider('tunegenie').parse
         for each in data:
-            mbox = box.Box(each)
-            for eachlist in mbox.response:
-                if eachlist.artist.startswith('Weekdays,') or eachlist.artist.startswith(
-                        "The Valley's") or eachlist.artist.startswith("Sundays,"):
-                    continue
-                self.music_list.append([eachlist.artist, eachlist.song])
+            self.music_list.extend(parse(each))
+
+    def parse_iheart_data(self, content):
+        """ Adds songs to list for an iheart recently played page or load_more response
+
+        :param content: bytes html content
+        :returns string token for the next page, None if there is no next page
+        """
+
+        songs, token = self.provider('iheart').page_songs(content)
+        self.music_list.extend(songs)
+        return token
+
+    def station_names(self, stations=None):
+        """ Names of the stations of the given station types
+
+        :param stations: tuple of station types in self.providers, every provider if not provided
+        :returns list of tuples of station type and station name
+        """
+
+        names = []
+        for station in (stations if stations else self.providers):
+            names.extend((station, name) for name in self.provider(station).station_names())
+        return names
+
+    async def collect_song(self, song, song_queue=None):
+        """ Add a scraped song to the music list, or to the queue of a running pipeline if one is given
+
+        :param song: Track
+        :param song_queue: asyncio.Queue
+        :returns coroutine None
+        """
+
+        if song_queue is None:
+            self.music_list.append(song)
+        else:
+            await song_queue.put(song)
 
     def run_synchronous_process(self):
         """ Routine to scrape recently played song title/artist info in synchronous mode"""
 
+        import requests
+        import box
+
         box_radio_stations = box.Box(self.radio_stations)
 
         for station in box_radio_stations.iheart.stations:
             content = requests.get(box_radio_stations.iheart.url.format(station),
                                    headers=box_radio_stations.iheart.headers).content
-            soup = BeautifulSoup(content, 'html.parser', from_encoding='utf-8')
-            for songinfo in [each.attrs['alt'] for each in soup.find_all() if 'alt' in each.attrs]:
-                songdetails = songinfo.split(' - ')[::-1]
-                if songdetails[0].startswith("Hawaii's Alternative") or songdetails[0].startswith('STATION_LOGO') or \
-                        songdetails[0].startswith('{{') or songdetails[0].startswith('iHeartRadio') or songdetails[
-                    0].startswith('Sundays,'):
-                    continue
-
-                self.music_list.append(songdetails)
-
-            token = \
-                [each.attrs['data-nextpagetoken'] for each in soup.find_all() if 'data-nextpagetoken' in each.attrs][0]
+            token = self.parse_iheart_data(content)
+
             data = box_radio_stations.iheart.data
-            interval = box_radio_stations.tunegenie.interval
+            interval = box_radio_stations.iheart.interval
             data[0][1] = token
             data[3][1] = interval
             url = box_radio_stations.iheart.next_url.format(station)
@@ -169,17 +187,166 @@ class MediaResources(object):
             box_radio_stations.iheart.next_headers.origin = box_radio_stations.iheart.next_headers.origin.format(
                 station)
             iheart_next_content = requests.post(url, headers=box_radio_stations.iheart.next_headers, data=data).content
-            next_soup = BeautifulSoup(iheart_next_content, 'html.parser', from_encoding='utf-8')
-            for songinfo in [each.attrs['alt'] for each in next_soup.find_all() if 'alt' in each.attrs]:
-                songdetails = songinfo.split(' - ')[::-1]
-                if songdetails[0].startswith("Hawaii's Alternative") or songdetails[0].startswith('STATION_LOGO') or \
-                        songdetails[0].startswith('{{') or songdetails[0].startswith('iHeartRadio') or songdetails[
-                    0].startswith('Sundays,'):
-                    continue
+            self.parse_iheart_data(iheart_next_content)
+
+    def window_planner(self, interval, checkpoint=None, station=None, lookahead=None, since=None, until=None):
+        """ Plan the (since, until) windows to query, walking backward from now over steps windows of interval hours
+
+        :param interval: int hours of the first windows
+        :param checkpoint: string iso formatted time stamp already processed, windows stop there
+        :param station: string station type whose page_size adapts the window widths, if its provider is adaptive
+        :param lookahead: int number of windows planned ahead of the ones recorded, no limit if not provided
+        :param since: string iso formatted start of the range to plan instead of the steps windows
+        :param until: string iso formatted end of the range to plan instead of now
+        :returns WindowPlanner
+        """
+
+        if until:
+            end = datetime.fromisoformat(until)
+        else:
+            end = datetime.fromisoformat(self.timestamp) if self.timestamp else datetime.now().replace(microsecond=0)
+        width = timedelta(hours=interval)
+        start = datetime.fromisoformat(since) if since else end - width * self.steps
+        if checkpoint:
+            start = max(start, datetime.fromisoformat(checkpoint))
+        config = self.radio_stations.get(station, {})
+        provider = self.providers.get(station)
+        return WindowPlanner(end, start, width, maximum=width * 4, page_size=config.get('page_size'),
+                             lookahead=lookahead, adaptive=provider is not None and provider.adaptive)
+
+    def get_time_windows(self, interval, checkpoint=None):
+        """ Generate the (since, until) windows to query, walking backward from now
+
+        :param interval: int hours of the windows
+        :param checkpoint: string iso formatted time stamp already processed, windows stop there
+        :returns generator of tuples of iso formatted time stamps
+        """
+
+        for window in self.window_planner(interval, checkpoint).windows():
+            yield window.since, window.until
+
+    def count_plays(self, name, since, until, songs):
+        """ Add the songs of a response to the play counts, if they are kept
+
+        :param name: string station name
+        :param since: string iso formatted start of the time window, None if the response is not a window
+        :param until: string iso formatted end of the time window, the time of the fetch if not provided
+        :param songs: list of Track, latest play first for a response that is not a window
+        :return: None
+        """
 
-                self.music_list.append(songdetails)
+        if self.play_counts is not None:
+            until = until if until else datetime.now().replace(microsecond=0).isoformat()
+            self.play_counts.add_response(name, since, until, songs)
 
-    async def fetch(self, headers, url, client, params=None, station=None, until=None, since=None):
+    def capture_response(self, station, name, since, until, body):
+        """ Write a raw response to the capture archive, if one is set
+
+        :param station: string station type
+        :param name: string station name
+        :param since: string iso formatted start of the time window, None if the response is not a window
+        :param until: string iso formatted end of the time window, the capture time if not provided
+        :param body: bytes raw response body
+        :return: None
+        """
+
+        if self.capture_archive is not None:
+            until = until if until else datetime.now().replace(microsecond=0).isoformat()
+            self.capture_archive.append(station, name, since, until, body)
+
+    async def replay_stations(self, stations=None, song_queue=None, names=None):
+        """ Feed the responses of the replay archive through the parsers instead of fetching the stations
+
+        :param stations: tuple of station types in self.providers to replay, every provider if not provided
+        :param song_queue: asyncio.Queue to put the songs on as they are parsed instead of the music list
+        :param names: collection of station names to restrict the replay to, every station if not provided
+        :returns coroutine None
+        """
+
+        archive = self.replay_archive
+        for record in archive.records(providers=stations if stations else tuple(self.providers), names=names):
+            provider = self.provider(record.provider)
+            with self.metrics.time('parse', record.station):
+                songs = provider.parse(provider.decode(archive.read(record)))
+            self.metrics.increment('records_parsed', len(songs), record.station)
+            # the responses that are not a window cannot be told apart from the pages that follow them, only the
+            # windows are counted again
+            if record.since:
+                self.count_plays(record.station, record.since, record.until, songs)
+            for song in songs:
+                await self.collect_song(song, song_queue)
+
+    def breaker(self, url):
+        """ Circuit breaker of the host of a url
+
+        :param url: string
+        :returns CircuitBreaker
+        """
+
+        host = urlsplit(url).netloc
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(host, self.breaker_threshold, self.breaker_reset)
+        return self.breakers[host]
+
+    async def request_with_retries(self, url, attempt, name=''):
+        """ Run a request with a timeout, retrying the server errors, timeouts and connection errors with a jittered
+            exponential backoff while the circuit breaker of the host lets the requests through
+
+            :param url: string url of the request, its host selects the circuit breaker
+            :param attempt: coroutine function sending the request once and returning its result
+            :param name: string station name for the metrics
+            :returns coroutine result of attempt
+        """
+
+        import aiohttp
+
+        breaker = self.breaker(url)
+        error = None
+        for attempt_number in range(self.retries + 1):
+            if attempt_number:
+                self.metrics.increment('retries', station=name)
+                await asyncio.sleep(self.backoff * 2 ** (attempt_number - 1) * (0.5 + random()))
+            if not breaker.allow():
+                raise CircuitOpenError(url, breaker.host)
+            try:
+                result = await asyncio.wait_for(attempt(), self.timeout)
+            except FetchError as exc:
+                if not exc.retryable:
+                    # the host answered, only the request is wrong
+                    breaker.record_success()
+                    raise
+                error = exc
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                error = exc
+            else:
+                breaker.record_success()
+                return result
+            breaker.record_failure()
+        raise error
+
+    async def decode(self, station, body, parse=False, name=''):
+        """ Decode a response body, or decode and parse it into songs
+
+            With a parse pool the songs are parsed in its processes and only the compact tracks come back, so that a
+            large backfill keeps the event loop free for the requests and parses on every core
+            :param station: string station type, the provider name
+            :param body: bytes raw response body
+            :param parse: bool return the songs of the response instead of the decoded response
+            :param name: string station name for the metrics
+            :returns coroutine decoded response or list of Track
+        """
+
+        if not parse:
+            return json.loads(body)
+        if self.parse_pool is not None:
+            packed = await asyncio.get_event_loop().run_in_executor(self.parse_pool, parse_body, station, body)
+            return unpack_tracks(packed)
+        provider = self.provider(station)
+        with self.metrics.time('parse', name):
+            return provider.parse(provider.decode(body))
+
+    async def fetch(self, headers, url, client, params=None, station=None, until=None, since=None, name='',
+                    parse=False):
         """ Async fetch method to retrieve song data from urls
             :param headers: dict connection header
             :param url: string url
@@ -188,23 +355,52 @@ class MediaResources(object):
             :param station: string station name
             :param until: datetime time stamp
             :param since: datetime time stamp
-            :returns coroutine json object
+            :param name: string station name for the metrics
+            :param parse: bool return the songs of the response, see decode
+            :returns coroutine json object, or list of Track when parse is set
         """
 
-        if station == 'tunegenie':
-            if until:
-                params[1][1] = until
-            else:
-                until = params[0][1]
-            params[0][1], params[1][1] = since, until
-        elif station == 'cbs_stations':
-            params[2][1] = since
-
-        async with client.get(url, params=params, headers=headers) as resp:
-            assert resp.status == 200
-            return await resp.json()
-
-    async def run_loop(self, loop, headers, url, params=None, station=None, interval=None):
+        # copy the parameters so that concurrent requests never share the time stamps
+        params = [list(each_param) for each_param in params] if params else None
+        if station in self.providers:
+            params = self.provider(station).window_params(params, since, until)
+
+        cache = self.response_cache
+        cached = None
+        if cache is not None:
+            key = cache.key(url, params)
+            cached = cache.get(key)
+            if cached is not None and cached.immutable:
+                cache.hit(cached)
+                self.metrics.increment('bytes_saved', len(cached.body), name)
+                self.capture_response(station, name, since, until, cached.body)
+                return await self.decode(station, cached.body, parse, name)
+            headers = dict(headers, **cache.conditional_headers(cached))
+
+        async def attempt():
+            async with client.get(url, params=params, headers=headers) as resp:
+                if resp.status == 304 and cached is not None:
+                    return None, None, None
+                check_status(resp)
+                return await resp.read(), resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+
+        started = time.perf_counter()
+        body, etag, last_modified = await self.request_with_retries(url, attempt, name)
+        if body is None:
+            body = cached.body
+            cache.not_modified(cached)
+            self.metrics.increment('bytes_saved', len(body), name)
+        else:
+            self.metrics.increment('response_bytes', len(body), name)
+            if cache is not None:
+                cache.set(key, body, etag, last_modified, cache.window_immutable(until))
+        self.metrics.observe('request_latency_seconds', time.perf_counter() - started, name)
+        self.metrics.increment('requests', station=name)
+        self.capture_response(station, name, since, until, body)
+        return await self.decode(station, body, parse, name)
+
+    async def run_loop(self, loop, headers, url, params=None, station=None, interval=None, client=None,
+                       checkpoint=None, name='', failed=None, parse=False):
         """ Async run loop method to fetch data
             :param loop: Asyncio event loop
             :param headers: dict connection header
@@ -212,35 +408,265 @@ class MediaResources(object):
             :param params: dict connection parameters
             :param station: string station name
             :param interval: dict number of iterations to loop through
-            :returns coroutine asyncio response
+            :param client: Async client session object to share, a new session is used if not provided
+            :param checkpoint: string iso formatted time stamp already processed, older windows are not fetched
+            :param name: string station name for the metrics
+            :param failed: list the (since, until) windows that failed are appended to
+            :param parse: bool return the songs of each window instead of its response, see decode
+            :returns coroutine list of the responses, or of the lists of Track, of the windows that did not fail
         """
 
-        until = None
-        wrap = None
-        since = None
-        if station == 'cbs_stations':
-            if len(params[-1]) == 1:
-                params[-1].append(self.timestamp)
-            wrap = self.wrapper(self.get_iso_time, interval)
+        if client is None:
+            import aiohttp
 
-        elif station == 'tunegenie':
-            wrap = self.wrapper(self.get_iso_time, interval)
+            async with aiohttp.ClientSession(loop=loop) as client:
+                return await self.run_loop(loop, headers, url, params=params, station=station, interval=interval,
+                                           client=client, checkpoint=checkpoint, name=name, failed=failed,
+                                           parse=parse)
 
+        windows = list(self.get_time_windows(interval, checkpoint))
         tasks = []
-        async with aiohttp.ClientSession(loop=loop) as client:
-
-            for i in range(self.steps):
-                if station == 'cbs_stations':
-                    since = next(wrap)
-
-                elif station == 'tunegenie':
-                    if self.timestamp is None:
-                        until = datetime.now().replace(microsecond=0).isoformat()
-                    since = next(wrap)
-                task = asyncio.ensure_future(self.fetch(headers, url, client, params, station,
-                                                        until=until if self.timestamp is None else None,
-                                                        since=since))
-                tasks.append(task)
-                self.timestamp = until
-            responses = await asyncio.gather(*tasks)
+        for since, until in windows:
+            task = asyncio.ensure_future(self.fetch(headers, url, client, params, station, until=until, since=since,
+                                                    name=name, parse=parse))
+            tasks.append(task)
+        responses = []
+        # a failed window does not throw away the responses of the others
+        for window, response in zip(windows, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(response, Exception):
+                self.metrics.increment('failed_windows', station=name)
+                if failed is not None:
+                    failed.append(window)
+                continue
+            responses.append(response)
         return responses
+
+    async def stream_loop(self, loop, headers, url, params=None, station=None, interval=None, client=None,
+                          max_in_flight=None, checkpoint=None, name='', failed=None, retry_windows=None):
+        """ Async generator to fetch data and yield songs as each response arrives
+
+            Only max_in_flight requests are kept running at once and each response is parsed, in the parse pool when
+            there is one, and dropped as soon as it completes, so memory does not grow with the number of steps. A
+            window that still fails after its retries is skipped and reported in failed, and once the circuit breaker
+            of the host opens no new window is requested, the windows left are reported in failed as well
+            :param loop: Asyncio event loop
+            :param headers: dict connection header
+            :param url: string url
+            :param params: dict connection parameters
+            :param station: string station name
+            :param interval: dict number of iterations to loop through
+            :param client: Async client session object to share, a new session is used if not provided
+            :param max_in_flight: int number of concurrent requests, defaults to self.max_in_flight
+            :param checkpoint: string iso formatted time stamp already processed, older windows are not fetched
+            :param name: string station name for the metrics
+            :param failed: list the (since, until) windows that failed are appended to
+            :param retry_windows: list of (since, until) ranges that failed on a previous run, fetched first
+            :returns async generator of Track
+        """
+
+        if client is None:
+            import aiohttp
+
+            async with aiohttp.ClientSession(loop=loop) as client:
+                async for song in self.stream_loop(loop, headers, url, params=params, station=station,
+                                                   interval=interval, client=client, max_in_flight=max_in_flight,
+                                                   checkpoint=checkpoint, name=name, failed=failed,
+                                                   retry_windows=retry_windows):
+                    yield song
+            return
+
+        max_in_flight = max_in_flight if max_in_flight else self.max_in_flight
+        # the planners only run a few windows ahead of the responses so that their plays can adapt the next windows
+        lookahead = min(max_in_flight, self.lookahead)
+        planners = [self.window_planner(interval, station=station, lookahead=lookahead, since=since, until=until)
+                    for since, until in (retry_windows if retry_windows else [])]
+        planners.append(self.window_planner(interval, checkpoint, station, lookahead=lookahead))
+        config = self.radio_stations.get(station, {})
+        breaker = self.breaker(url)
+        pending = {}
+        try:
+            while True:
+                # an open breaker only lets a single trial window through, the others wait for it to close
+                while planners and len(pending) < max_in_flight and breaker.ready() and \
+                        not (breaker.is_open and pending):
+                    window = planners[0].next_window()
+                    if window is None:
+                        # a planner is kept until its windows are recorded, a full one is planned again as halves
+                        if not planners[0].done or planners[0].outstanding:
+                            break
+                        planners.pop(0)
+                        continue
+                    task = asyncio.ensure_future(self.fetch(headers, url, client, params, station, until=window.until,
+                                                            since=window.since, name=name, parse=True))
+                    pending[task] = (planners[0], window)
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    planner, window = pending.pop(task)
+                    try:
+                        songs = task.result()
+                    except Exception:
+                        planner.record(window, None)
+                        self.metrics.increment('failed_windows', station=name)
+                        if failed is not None:
+                            failed.append((window.since, window.until))
+                        continue
+                    planner.record(window, len(songs))
+                    # a page size inferred from the responses is kept for the other planners and the next runs
+                    if planner.page_size and not config.get('page_size'):
+                        config['page_size'] = planner.page_size
+                        for each_planner in planners:
+                            each_planner.page_size = each_planner.page_size or planner.page_size
+                    self.metrics.increment('records_parsed', len(songs), name)
+                    self.count_plays(name, window.since, window.until, songs)
+                    for song in songs:
+                        yield song
+            # windows left unplanned because the circuit breaker is open, the next run sends its trial request
+            if failed is not None:
+                for planner in planners:
+                    failed.extend(planner.remaining())
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def enqueue_jobs(self, stations=None, names=None):
+        """ Split the stations into (station, window) jobs of the job queue
+
+        :param stations: tuple of station types in self.providers, every provider if not provided
+        :param names: collection of station names to restrict the run to, every station if not provided
+        :returns string batch id
+        """
+
+        jobs = []
+        for station, name in self.station_names(stations):
+            if names is None or name in names:
+                jobs.extend((station, name, since, until) for since, until in self.provider(station).job_windows(name))
+        config = {station: self.radio_stations[station] for station in (stations if stations else self.providers)}
+        return self.job_queue.add_batch(config, jobs)
+
+    async def run_jobs(self, stations=None, song_queue=None, names=None, poll=0.5):
+        """ Run the stations through the job queue and collect the songs the workers write back
+
+        :param stations: tuple of station types in self.providers, every provider if not provided
+        :param song_queue: asyncio.Queue to put the songs on as they are read instead of the music list
+        :param names: collection of station names to restrict the run to, every station if not provided
+        :param poll: float seconds between two reads of the queue
+        :returns coroutine dict of station name to the error of the stations with a failed job
+
+            The local workers fetch through the response cache file. The responses cannot be captured, a capture
+            archive is rejected.
+        """
+
+        from gmusic.job_queue import start_worker, start_workers
+
+        if self.capture_archive is not None:
+            raise ValueError('the responses of a job queue run are fetched by the workers, they cannot be captured')
+        job_queue = self.job_queue
+        started = self.timestamp if self.timestamp else datetime.now().replace(microsecond=0).isoformat()
+        batch = self.enqueue_jobs(stations, names)
+        # the local workers share the response cache file, each through its own connection
+        cache_file = self.response_cache.cache_file if self.response_cache is not None else None
+        workers = start_workers(job_queue, self.workers, response_cache_file=cache_file)
+        # a worker that died is replaced, within the number of claims a job gets, and once every worker keeps dying
+        # the batch is failed instead of waiting for jobs that nothing runs
+        respawns = self.workers * job_queue.max_attempts
+        try:
+            while True:
+                if workers and not all(each_worker.is_alive() for each_worker in workers) and \
+                        job_queue.unfinished(batch):
+                    for position, each_worker in enumerate(workers):
+                        if each_worker.is_alive():
+                            continue
+                        if respawns:
+                            respawns -= 1
+                            print("worker", each_worker.pid, "exited with", each_worker.exitcode, "replacing it")
+                            workers[position] = start_worker(job_queue, response_cache_file=cache_file)
+                    if not any(each_worker.is_alive() for each_worker in workers):
+                        job_queue.fail_batch(batch, 'every worker died')
+                # a job is done in the transaction writing its songs, so once none is left every song can be read
+                finished = not job_queue.unfinished(batch)
+                collected = job_queue.collect(batch)
+                for name, since, until, songs in collected:
+                    songs = [Track(artist, title) for artist, title in songs]
+                    self.metrics.increment('records_parsed', len(songs), name)
+                    self.count_plays(name, since, until, songs)
+                    for song in songs:
+                        await self.collect_song(song, song_queue)
+                if finished and not collected:
+                    break
+                if not collected:
+                    await asyncio.sleep(poll)
+        finally:
+            for each_worker in workers:
+                # idle workers exit on their next claim, after closing their response cache
+                each_worker.join(timeout=5)
+                if each_worker.is_alive():
+                    each_worker.terminate()
+
+        failures = job_queue.failed_stations(batch)
+        failed_windows = job_queue.failed_windows(batch)
+        for name, error in failures.items():
+            self.metrics.increment('station_failures', station=name)
+            print(name, "fetch failed", error)
+        for name, windows in failed_windows.items():
+            self.metrics.increment('failed_windows', len(windows), name)
+            print(name, len(windows), "windows failed, they are fetched again on the next run")
+        if self.checkpoints is not None:
+            for station, name in self.station_names(stations):
+                if isinstance(self.provider(station), WindowedJsonProvider) and (names is None or name in names):
+                    self.checkpoints.update(name, started)
+                    self.checkpoints.set_failed_windows(name, failed_windows.get(name, []))
+        job_queue.purge(batch)
+        return failures
+
+    def create_client(self, loop):
+        """ Create the pooled client session shared by the stations
+
+        :param loop: Asyncio event loop
+        :returns aiohttp.ClientSession
+        """
+
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.connection_limit, limit_per_host=self.connection_limit_per_host,
+                                         loop=loop)
+        return aiohttp.ClientSession(loop=loop, connector=connector)
+
+    async def run_stations(self, loop, stations=None, song_queue=None, names=None, client=None):
+        """ Fetch and parse every station concurrently on one loop and one pooled client session
+            :param loop: Asyncio event loop
+            :param stations: tuple of station types in self.providers to fetch, every provider if not provided
+            :param song_queue: asyncio.Queue to put the songs on as they are parsed instead of the music list
+            :param names: collection of station names to restrict the run to, every station if not provided
+            :param client: pooled client session to use, from create_client, a new one is used if not provided
+            :returns coroutine dict of station name to the error of the stations that failed
+
+            With a job queue the stations are fetched by the worker processes instead, see run_jobs
+        """
+
+        if self.replay_archive is not None:
+            await self.replay_stations(stations, song_queue, names)
+            return {}
+        if self.job_queue is not None:
+            return await self.run_jobs(stations, song_queue, names)
+        if client is None:
+            async with self.create_client(loop) as client:
+                return await self.run_stations(loop, stations=stations, song_queue=song_queue, names=names,
+                                               client=client)
+
+        failures = {}
+
+        async def run_station(station, name):
+            # a failing station does not stop the others, the songs it already produced are kept
+            try:
+                with self.metrics.time('station', name):
+                    await self.provider(station).fetch_station(loop, client, name, song_queue)
+            except Exception as exc:
+                failures[name] = exc
+                self.metrics.increment('station_failures', station=name)
+                print(name, "fetch failed", repr(exc))
+
+        await asyncio.gather(*[run_station(station, name) for station, name in self.station_names(stations)
+                               if names is None or name in names])
+        return failures
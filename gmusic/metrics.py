@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.metrics
+~~~~~~~~~~~~~~
+
+This module records per station and per stage timings, request latencies and counters of a run and exports them as
+json or in the Prometheus text format
+
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+import threading
+import time
+
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics(object):
+    """
+    Collects the metrics of a run. Every metric is keyed by its name and the station it belongs to, '' for the
+    metrics that are not about a single station.
+    """
+
+    enabled = True
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # (stage, station) -> [number of runs, total seconds]
+        self.timings = defaultdict(lambda: [0, 0.0])
+        # (name, station) -> value
+        self.counters = defaultdict(int)
+        # (name, station) -> [count per bucket plus overflow, count, sum]
+        self.histograms = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0, 0.0])
+        # the search workers record from their own threads
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage, station=''):
+        """ Context manager timing a stage
+
+        :param stage: string stage name
+        :param station: string station name
+        """
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(stage, time.perf_counter() - started, station)
+
+    def record_time(self, stage, seconds, station=''):
+        with self.lock:
+            timing = self.timings[(stage, station)]
+            timing[0] += 1
+            timing[1] += seconds
+
+    def increment(self, name, value=1, station=''):
+        """ Add to a counter
+
+        :param name: string counter name
+        :param value: int
+        :param station: string station name
+        :return: None
+        """
+
+        with self.lock:
+            self.counters[(name, station)] += value
+
+    def observe(self, name, value, station=''):
+        """ Add an observation to a histogram
+
+        :param name: string histogram name
+        :param value: float
+        :param station: string station name
+        :return: None
+        """
+
+        with self.lock:
+            histogram = self.histograms[(name, station)]
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def cache_hit_rate(self, station=''):
+        hits = self.counters.get(('cache_hits', station), 0)
+        misses = self.counters.get(('cache_misses', station), 0)
+        return hits / (hits + misses) if hits + misses else None
+
+    def to_dict(self):
+        """ Metrics grouped by station
+
+        :return: dict
+        """
+
+        stations = defaultdict(lambda: {'stages': {}, 'counters': {}, 'histograms': {}})
+        for (stage, station), (runs, seconds) in self.timings.items():
+            stations[station]['stages'][stage] = {'runs': runs, 'seconds': seconds}
+        for (name, station), value in self.counters.items():
+            stations[station]['counters'][name] = value
+        for (name, station), (bucket_counts, count, total) in self.histograms.items():
+            stations[station]['histograms'][name] = {
+                'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], bucket_counts)),
+                'count': count,
+                'sum': total,
+            }
+        for station, station_metrics in stations.items():
+            hit_rate = self.cache_hit_rate(station)
+            if hit_rate is not None:
+                station_metrics['cache_hit_rate'] = hit_rate
+        return dict(stations)
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='gmusic'):
+        """ Metrics in the Prometheus text exposition format
+
+        :param prefix: string prefix of the metric names
+        :return: string
+        """
+
+        def labels(**values):
+            pairs = ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                             for key, value in sorted(values.items()) if value != '')
+            return '{{{}}}'.format(pairs) if pairs else ''
+
+        lines = []
+        if self.timings:
+            lines.append('# TYPE {}_stage_seconds_total counter'.format(prefix))
+            for (stage, station), (runs, seconds) in sorted(self.timings.items()):
+                lines.append('{}_stage_seconds_total{} {}'.format(prefix, labels(stage=stage, station=station),
+                                                                  seconds))
+            lines.append('# TYPE {}_stage_runs_total counter'.format(prefix))
+            for (stage, station), (runs, seconds) in sorted(self.timings.items()):
+                lines.append('{}_stage_runs_total{} {}'.format(prefix, labels(stage=stage, station=station), runs))
+        for name in sorted({name for name, station in self.counters}):
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            for (counter_name, station), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append('{}_{}_total{} {}'.format(prefix, name, labels(station=station), value))
+        for name in sorted({name for name, station in self.histograms}):
+            lines.append('# TYPE {}_{} histogram'.format(prefix, name))
+            for (histogram_name, station), (bucket_counts, count, total) in sorted(self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bucket, bucket_count in zip([str(bucket) for bucket in self.buckets] + ['+Inf'], bucket_counts):
+                    cumulative += bucket_count
+                    lines.append('{}_{}_bucket{} {}'.format(prefix, name, labels(station=station, le=bucket),
+                                                             cumulative))
+                lines.append('{}_{}_sum{} {}'.format(prefix, name, labels(station=station), total))
+                lines.append('{}_{}_count{} {}'.format(prefix, name, labels(station=station), count))
+        return '\n'.join(lines + [''])
+
+    def export(self, path):
+        """ Write the metrics to a file, in the Prometheus text format for a .prom file and json otherwise
+
+        :param path: string
+        :return: None
+        """
+
+        with open(path, 'w') as metrics_file:
+            metrics_file.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+class NullMetrics(Metrics):
+    """
+    Disabled metrics, every hook is a no-op
+    """
+
+    enabled = False
+
+    def time(self, stage, station=''):
+        return nullcontext()
+
+    def record_time(self, stage, seconds, station=''):
+        pass
+
+    def increment(self, name, value=1, station=''):
+        pass
+
+    def observe(self, name, value, station=''):
+        pass
+
+
+# shared disabled metrics, the default of every class with metrics hooks
+NULL_METRICS = NullMetrics()
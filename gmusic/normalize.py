@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.normalize
+~~~~~~~~~~~~~~~~
+
+This module cleans the scraped artist and title strings and turns them into the canonical keys used for the library
+lookups, with precompiled regular expressions so that whole batches of songs are normalized cheaply
+
+"""
+
+from collections import namedtuple
+import re
+
+
+# words that contain the following are removed from artists and titles
+MYFILTER = ['**', '[', ']', '(', ')', '+']
+
+# artists starting with the following are station branding and not songs
+BRANDING_PREFIXES = ('Weekdays,', "The Valley's", 'Sundays,', "Hawaii's Alternative", 'STATION_LOGO', '{{',
+                     'iHeartRadio')
+
+# whole words containing one of MYFILTER, only tried at the start of words to keep the scan linear
+FILTERED_WORD = re.compile(r'(?<!\S)(?=\S*?(?:{}))\S+'.format('|'.join(re.escape(each) for each in MYFILTER)))
+# newlines separate the values of a batch so only the other whitespace is collapsed
+WHITESPACE = re.compile(r'[^\S\n]+')
+
+# a cleaned song with its canonical (artist, title) key
+NormalizedSong = namedtuple('NormalizedSong', ['artist', 'title', 'key'])
+
+
+def is_branding(artist):
+    """ Check if a scraped artist is station branding rather than a song
+
+    :param artist: string
+    :return: bool
+    """
+
+    return artist.startswith(BRANDING_PREFIXES)
+
+
+def clean_words(values):
+    """ Remove the words matching MYFILTER and collapse the whitespace of a batch of values
+
+    The values are joined so that each regular expression runs once over the whole batch
+
+    :param values: list of strings
+    :return: list of strings
+    """
+
+    if not values:
+        return []
+    joined = '\n'.join(values)
+    if joined.count('\n') != len(values) - 1:
+        joined = '\n'.join(value.replace('\n', ' ') for value in values)
+    return [value.strip() for value in WHITESPACE.sub(' ', FILTERED_WORD.sub('', joined)).split('\n')]
+
+
+def canonical_keys(values):
+    """ Canonical form of a batch of cleaned artists or titles, the form used by the library index
+
+    :param values: list of strings
+    :return: list of strings
+    """
+
+    if not values:
+        return []
+    return '\n'.join(values).casefold().split('\n')
+
+
+def normalize_songs(songs):
+    """ Clean a batch of scraped songs, dropping branding, unusable songs and duplicates
+
+    :param songs: iterable of sequences whose first two items are artist and title
+    :return: list of NormalizedSong in the order they were first seen
+    """
+
+    songs = [each_song for each_song in songs if not each_song[0].startswith(BRANDING_PREFIXES)]
+    artists = clean_words([each_song[0] for each_song in songs])
+    titles = clean_words([each_song[1] for each_song in songs])
+
+    seen = set()
+    normalized = []
+    for artist, title, key in zip(artists, titles, zip(canonical_keys(artists), canonical_keys(titles))):
+        if key in seen or '??' in artist or '??' in title:
+            continue
+        seen.add(key)
+        normalized.append(NormalizedSong(artist, title, key))
+    return normalized
+
+
+def normalize_song(artist, title):
+    """ Clean a single scraped song
+
+    :param artist: string
+    :param title: string
+    :return: NormalizedSong, None if the song is branding or unusable
+    """
+
+    normalized = normalize_songs([(artist, title)])
+    return normalized[0] if normalized else None
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.pipeline
+~~~~~~~~~~~~~~~
+
+This module runs the scrape, normalize, library check, search and playlist batch stages concurrently, connected by
+bounded queues, so that songs are searched for while the radio stations are still being scraped
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import datetime
+
+from gmusic.normalize import normalize_songs
+from gmusic.metrics import NULL_METRICS
+
+
+# marks the end of the songs on a queue
+DONE = None
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls so that no more than rate calls per second are started
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self, loop):
+        """ Wait for the next available call slot
+
+        :param loop: Asyncio event loop
+        :returns coroutine None
+        """
+
+        async with self.lock:
+            now = loop.time()
+            if self.next_call > now:
+                await asyncio.sleep(self.next_call - now)
+                now = self.next_call
+            self.next_call = now + self.interval
+
+
+class SongPipeline(object):
+    """
+    Staged producer/consumer pipeline from the radio station scrape to the list of songs to add to the playlists
+    """
+
+    def __init__(self, media_resources, google_music_fetch, library_index, queue_size=1000, search_workers=4,
+                 searches_per_second=None, stations=None, metrics=None, names=None, client=None, trending=None,
+                 rate_limiter=None):
+        """
+        :param media_resources: MediaResources used to scrape the stations
+        :param google_music_fetch: FetchSongs used to search for the song ids
+        :param library_index: LibraryIndex of the songs already in the library
+        :param queue_size: int bound of each queue between the stages
+        :param search_workers: int number of threads running the blocking searches
+        :param searches_per_second: float rate limit of the searches, no limit if not provided
+        :param stations: tuple of station providers to scrape, every provider of media_resources if not provided
+        :param metrics: Metrics counting the songs going through each stage, disabled if not provided
+        :param names: collection of station names to restrict the scrape to, every station if not provided
+        :param client: pooled client session kept between runs, a new one is used if not provided
+        :param trending: int number of new songs searched for, the most trending ones according to the play counts of
+            media_resources, every new song is searched for as soon as it is scraped if not provided
+        :param rate_limiter: RateLimiter shared with other pipelines, replaces searches_per_second
+        """
+
+        if trending and media_resources.play_counts is None:
+            raise ValueError('the trending songs are ranked by the play counts of media_resources, it has none')
+        self.media_resources = media_resources
+        self.google_music_fetch = google_music_fetch
+        self.library_index = library_index
+        self.queue_size = queue_size
+        self.search_workers = search_workers
+        self.searches_per_second = searches_per_second
+        self.stations = stations
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.names = names
+        self.client = client
+        self.trending = trending
+        self.rate_limiter = rate_limiter
+        self.song_list = []
+
+    async def scrape(self, loop, scraped):
+        """ Scrape stage, puts the raw songs of every station on the scraped queue """
+
+        try:
+            await self.media_resources.run_stations(loop, stations=self.stations, song_queue=scraped, names=self.names,
+                                                    client=self.client)
+        finally:
+            await scraped.put(DONE)
+
+    async def normalize(self, scraped, normalized):
+        """ Normalize stage, cleans the songs waiting on the queue as one batch and drops the duplicates """
+
+        seen = set()
+        done = False
+        while not done:
+            batch = [await scraped.get()]
+            while not scraped.empty():
+                batch.append(scraped.get_nowait())
+            if batch[-1] is DONE:
+                batch.pop()
+                done = True
+            self.metrics.increment('songs_scraped', len(batch))
+            for song in normalize_songs(batch):
+                if song.key in seen:
+                    continue
+                seen.add(song.key)
+                self.metrics.increment('songs_normalized')
+                await normalized.put(song)
+        await normalized.put(DONE)
+
+    async def check_library(self, normalized, new_songs):
+        """ Library check stage, drops the songs already in the library
+
+            When only the trending songs are searched for, the new songs are held back until the scrape is over and
+            only the most trending ones are passed on
+        """
+
+        held_back = []
+        while True:
+            each_song = await normalized.get()
+            if each_song is DONE:
+                break
+            with self.metrics.time('library_check'):
+                in_library = self.library_index.contains_key(each_song.key)
+            if in_library:
+                continue
+            self.metrics.increment('songs_new')
+            if self.trending:
+                held_back.append(each_song)
+            else:
+                await new_songs.put(each_song)
+        if self.trending:
+            play_counts = self.media_resources.play_counts
+            for each_song in play_counts.trending(held_back, self.trending):
+                self.metrics.increment('songs_trending')
+                await new_songs.put(each_song)
+        for worker in range(self.search_workers):
+            await new_songs.put(DONE)
+
+    async def search(self, loop, executor, rate_limiter, new_songs, found_songs):
+        """ Search stage worker, looks up the song ids in a worker thread """
+
+        while True:
+            each_song = await new_songs.get()
+            if each_song is DONE:
+                break
+            artist, song = each_song.artist, each_song.title
+            await rate_limiter.wait(loop)
+            try:
+                song_nid = await loop.run_in_executor(executor, self.google_music_fetch.search_for_songs, artist, song)
+            except Exception as exc:
+                # a failed search is not cached, the song is searched for again when it is scraped on the next run
+                print(artist, song, "search failed", repr(exc))
+                self.metrics.increment('search_errors')
+                continue
+            if song_nid:
+                # need to save the timestamp as well
+                timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self.metrics.increment('songs_found')
+                await found_songs.put([artist, song, song_nid, timestamp])
+        await found_songs.put(DONE)
+
+    async def batch(self, found_songs):
+        """ Playlist batch stage, collects the found songs for the playlist insertion """
+
+        remaining_workers = self.search_workers
+        while remaining_workers:
+            each_song = await found_songs.get()
+            if each_song is DONE:
+                remaining_workers -= 1
+                continue
+            self.song_list.append(each_song)
+
+    async def run(self, loop):
+        """ Run every stage of the pipeline until the scraped songs are exhausted
+
+        :param loop: Asyncio event loop
+        :returns coroutine list of [artist, title, song id, timestamp] lists
+        """
+
+        scraped, normalized, new_songs, found_songs = [asyncio.Queue(maxsize=self.queue_size) for i in range(4)]
+        rate_limiter = self.rate_limiter if self.rate_limiter is not None else RateLimiter(self.searches_per_second)
+        with ThreadPoolExecutor(max_workers=self.search_workers) as executor:
+            stages = [asyncio.ensure_future(stage) for stage in [
+                self.scrape(loop, scraped),
+                self.normalize(scraped, normalized),
+                self.check_library(normalized, new_songs),
+                self.batch(found_songs),
+                *[self.search(loop, executor, rate_limiter, new_songs, found_songs)
+                  for worker in range(self.search_workers)]]]
+            try:
+                await asyncio.gather(*stages)
+            finally:
+                # the stages left when one fails would wait on its queue forever
+                for stage in stages:
+                    stage.cancel()
+                await asyncio.gather(*stages, return_exceptions=True)
+        return self.song_list
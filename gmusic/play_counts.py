@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.play_counts
+~~~~~~~~~~~~~~~~~~
+
+This module keeps a sqlite backed rollup of how often each station plays each song, per time bucket. The counts are
+added to as the scraped songs stream in, so how often and where a song was played is known without going over the
+scraped songs again, and the new songs can be ranked by how much they are trending
+
+"""
+
+from collections import Counter
+from datetime import datetime
+import os
+import sqlite3
+import time
+
+from gmusic.normalize import canonical_keys, clean_words, is_branding
+
+
+class PlayCounts(object):
+    """
+    Disk backed play counts keyed by the canonical (artist, title) of a song, the station and the start of a bucket of
+    bucket seconds.
+
+    The station responses do not carry the time of each play, the plays of a response are counted in the bucket of the
+    end of its time window. A time window is counted once however often it is fetched or replayed. The responses that
+    are not a time window list the latest plays first and only their plays newer than the ones of the previous
+    response of the station are counted. Buckets older than keep seconds are removed when the store is closed.
+    """
+
+    def __init__(self, counts_file=None, bucket=3600, keep=90 * 24 * 3600, flush_every=1000):
+        """
+        :param counts_file: string sqlite file, ~/.gmusic/play_counts.sqlite if not provided
+        :param bucket: int seconds of a time bucket
+        :param keep: int seconds the buckets are kept
+        :param flush_every: int number of plays buffered before they are added to the store
+        """
+
+        if counts_file:
+            self.counts_file = counts_file
+        else:
+            self.counts_file = os.path.expanduser('~/.gmusic/play_counts.sqlite')
+
+        self.bucket = bucket
+        self.keep = keep
+        self.flush_every = flush_every
+        self.pending = []
+        self.pending_windows = set()
+        self.heads = {}
+
+        directory = os.path.dirname(self.counts_file)
+        if directory and self.counts_file != ':memory:':
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.counts_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS play_counts ('
+                                'artist TEXT NOT NULL, title TEXT NOT NULL, station TEXT NOT NULL, '
+                                'bucket INTEGER NOT NULL, plays INTEGER NOT NULL, '
+                                'PRIMARY KEY (artist, title, station, bucket))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS play_counts_bucket ON play_counts (bucket)')
+        # the time windows already counted, and the latest play counted for the stations without windows
+        self.connection.execute('CREATE TABLE IF NOT EXISTS counted_windows ('
+                                'station TEXT NOT NULL, since TEXT NOT NULL, until TEXT NOT NULL, '
+                                'PRIMARY KEY (station, since, until))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS latest_plays ('
+                                'station TEXT PRIMARY KEY, artist TEXT NOT NULL, title TEXT NOT NULL)')
+        self.connection.commit()
+
+    def counted(self, station, since, until):
+        """ Check if a time window of a station was already counted """
+
+        if (station, since, until) in self.pending_windows:
+            return True
+        return self.connection.execute('SELECT 1 FROM counted_windows WHERE station = ? AND since = ? AND until = ?',
+                                       (station, since, until)).fetchone() is not None
+
+    def latest_play(self, station):
+        """ Latest play counted for a station without windows, as a raw (artist, title) tuple """
+
+        if station not in self.heads:
+            row = self.connection.execute('SELECT artist, title FROM latest_plays WHERE station = ?',
+                                          (station,)).fetchone()
+            self.heads[station] = tuple(row) if row else None
+        return self.heads[station]
+
+    def add_response(self, station, since, until, songs):
+        """ Count the plays of a station response, plays are buffered and added to the store in batches
+
+        :param station: string station name
+        :param since: string iso formatted start of the time window, None for a response that is not a window
+        :param until: string iso formatted end of the time window, or time of the fetch
+        :param songs: list of sequences whose first two items are the raw artist and title, latest play first for a
+            response that is not a window
+        :return: int number of plays counted
+        """
+
+        if since:
+            if self.counted(station, since, until):
+                return 0
+            self.pending_windows.add((station, since, until))
+        elif songs:
+            latest = self.latest_play(station)
+            plays = [(each_song[0], each_song[1]) for each_song in songs]
+            self.heads[station] = plays[0]
+            if latest in plays:
+                songs = songs[:plays.index(latest)]
+        bucket = int(datetime.fromisoformat(until).timestamp() // self.bucket * self.bucket)
+        self.pending.extend((each_song[0], each_song[1], station, bucket) for each_song in songs)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+        return len(songs)
+
+    def flush(self):
+        """ Add the buffered plays to the store
+
+        :return: None
+        """
+
+        plays = [each_play for each_play in self.pending if not is_branding(each_play[0])]
+        self.pending = []
+        artists = canonical_keys(clean_words([each_play[0] for each_play in plays]))
+        titles = canonical_keys(clean_words([each_play[1] for each_play in plays]))
+        counts = Counter((artist, title, each_play[2], each_play[3])
+                         for artist, title, each_play in zip(artists, titles, plays) if artist and title)
+        # the plays, the windows they came from and the latest plays are committed together
+        self.connection.executemany('INSERT INTO play_counts (artist, title, station, bucket, plays) '
+                                    'VALUES (?, ?, ?, ?, ?) ON CONFLICT (artist, title, station, bucket) '
+                                    'DO UPDATE SET plays = plays + excluded.plays',
+                                    ((artist, title, station, bucket, plays)
+                                     for (artist, title, station, bucket), plays in counts.items()))
+        self.connection.executemany('INSERT OR IGNORE INTO counted_windows (station, since, until) VALUES (?, ?, ?)',
+                                    self.pending_windows)
+        self.pending_windows = set()
+        self.connection.executemany('INSERT OR REPLACE INTO latest_plays (station, artist, title) VALUES (?, ?, ?)',
+                                    ((station, head[0], head[1]) for station, head in self.heads.items() if head))
+        self.connection.commit()
+
+    def plays(self, key, since=None):
+        """ Plays of a song per station
+
+        :param key: tuple canonical (artist, title), the key of a NormalizedSong
+        :param since: float epoch seconds, every kept bucket if not provided
+        :return: dict station name to number of plays
+        """
+
+        self.flush()
+        return dict(self.connection.execute('SELECT station, sum(plays) FROM play_counts '
+                                            'WHERE artist = ? AND title = ? AND bucket >= ? GROUP BY station',
+                                            (key[0], key[1], since if since else 0)).fetchall())
+
+    def scores(self, recent=7 * 24 * 3600, baseline=28 * 24 * 3600):
+        """ Trending score of every song played in the recent period
+
+        The score is the number of recent plays above what the play rate of the baseline period before it predicts,
+        so a song that just started being played ranks above one that was played as much for weeks. The number of
+        stations that played the song recently breaks the ties.
+
+        :param recent: int seconds of the recent period
+        :param baseline: int seconds of the period before it
+        :return: dict canonical (artist, title) key to tuple of score, recent plays and recent stations
+        """
+
+        self.flush()
+        now = time.time()
+        recent_since = now - recent
+        rows = self.connection.execute('SELECT artist, title, '
+                                       'sum(CASE WHEN bucket >= ? THEN plays ELSE 0 END), '
+                                       'sum(CASE WHEN bucket < ? THEN plays ELSE 0 END), '
+                                       'count(DISTINCT CASE WHEN bucket >= ? THEN station END) '
+                                       'FROM play_counts WHERE bucket >= ? GROUP BY artist, title',
+                                       (recent_since, recent_since, recent_since, recent_since - baseline))
+        return {(artist, title): (recent_plays - older_plays * recent / baseline, recent_plays, stations)
+                for artist, title, recent_plays, older_plays, stations in rows if recent_plays}
+
+    def trending(self, songs, limit, recent=7 * 24 * 3600, baseline=28 * 24 * 3600):
+        """ The limit most trending of a list of songs
+
+        :param songs: list of NormalizedSong
+        :param limit: int number of songs kept
+        :param recent: int seconds of the recent period, see scores
+        :param baseline: int seconds of the period before it
+        :return: list of NormalizedSong, most trending first
+        """
+
+        scores = self.scores(recent, baseline)
+        ranked = sorted(songs, key=lambda each_song: scores.get(each_song.key, (0, 0, 0)), reverse=True)
+        return ranked[:limit]
+
+    def evict(self):
+        """ Remove the buckets and the counted windows older than keep
+
+        :return: None
+        """
+
+        cutoff = time.time() - self.keep
+        self.connection.execute('DELETE FROM play_counts WHERE bucket < ?', (cutoff,))
+        self.connection.execute('DELETE FROM counted_windows WHERE until < ?',
+                                (datetime.fromtimestamp(cutoff).replace(microsecond=0).isoformat(),))
+        self.connection.commit()
+
+    def close(self):
+        """ Flush, evict and close the store
+
+        :return: None
+        """
+
+        self.flush()
+        self.evict()
+        self.connection.close()
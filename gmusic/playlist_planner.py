@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.playlist_planner
+~~~~~~~~~~~~~~~~~~~~~~~
+
+This module plans which playlists new songs go to, filling the playlists that still have space before opening new
+ones
+
+"""
+
+from collections import namedtuple
+
+
+# maximum number of songs that we keep in a playlist
+PLAYLIST_CAPACITY = 800
+
+# songs song_list[start:stop] go to playlist_id, playlist_id is None for a playlist that has to be created first
+PlaylistAllocation = namedtuple('PlaylistAllocation', ['playlist_id', 'start', 'stop', 'new'])
+
+
+class PlaylistPlanner(object):
+    """
+    Keeps the number of songs in each playlist and assigns batches of songs to the available slots
+    """
+
+    def __init__(self, counts=None, capacity=PLAYLIST_CAPACITY):
+        """
+        :param counts: dict of playlist id to number of songs
+        :param capacity: int maximum number of songs in a playlist
+        """
+
+        self.counts = dict(counts) if counts else {}
+        self.capacity = capacity
+
+    @classmethod
+    def from_dataframe(cls, dataframe, capacity=PLAYLIST_CAPACITY):
+        """ Count the songs of every playlist in the library in one pass
+
+        :param dataframe: pandas dataframe with a playlist_id column
+        :param capacity: int maximum number of songs in a playlist
+        :return: PlaylistPlanner
+        """
+
+        return cls(counts=dataframe.playlist_id.value_counts().to_dict(), capacity=capacity)
+
+    def available_space(self):
+        """ Playlists that are not full with their number of free slots, fullest playlists first
+
+        :return: list of (playlist id, free slots) tuples
+        """
+
+        return [(playlist_id, self.capacity - count)
+                for playlist_id, count in sorted(self.counts.items(), key=lambda item: -item[1])
+                if count < self.capacity]
+
+    def plan(self, number_of_songs):
+        """ Assign a batch of songs to playlists
+
+        :param number_of_songs: int number of songs in the batch
+        :return: list of PlaylistAllocation
+        """
+
+        allocations = []
+        start = 0
+        for playlist_id, free_slots in self.available_space():
+            if start >= number_of_songs:
+                break
+            stop = min(number_of_songs, start + free_slots)
+            allocations.append(PlaylistAllocation(playlist_id, start, stop, False))
+            start = stop
+
+        while start < number_of_songs:
+            stop = min(number_of_songs, start + self.capacity)
+            allocations.append(PlaylistAllocation(None, start, stop, True))
+            start = stop
+        return allocations
+
+    def add(self, playlist_id, number_of_songs):
+        """ Record songs added to a playlist
+
+        :param playlist_id: string playlist id
+        :param number_of_songs: int
+        :return: None
+        """
+
+        self.counts[playlist_id] = self.counts.get(playlist_id, 0) + number_of_songs
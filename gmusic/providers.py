@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.providers
+~~~~~~~~~~~~~~~~
+
+This module defines the radio station providers. A provider holds the station definitions of one kind of radio
+station site and knows how to fetch and parse their recently played songs. Providers are registered by name and
+MediaResources runs the registered ones, so a new kind of station only needs a provider class.
+
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import asyncio
+import json
+import time
+
+from gmusic.iheart_extract import IHeartExtractor, extract_iheart_page
+from gmusic.normalize import is_branding
+from gmusic.resilience import check_status
+
+
+# registered provider classes by name
+PROVIDERS = {}
+
+# a scraped song as parsed from a station response
+Track = namedtuple('Track', ['artist', 'title'])
+
+
+def register_provider(provider_class):
+    """ Class decorator registering a provider under its name
+
+    :param provider_class: StationProvider subclass
+    :return: the provider class
+    """
+
+    PROVIDERS[provider_class.name] = provider_class
+    return provider_class
+
+
+def get_provider(name):
+    """ Look up a registered provider class
+
+    :param name: string provider name
+    :return: StationProvider subclass
+    """
+
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ValueError('Unknown station provider {}, registered providers are {}'.format(
+            name, ', '.join(sorted(PROVIDERS))))
+
+
+def parse_body(provider_name, body):
+    """ Decode and parse a raw response body, in the worker processes of a parse pool
+
+    The songs are sent back as a single null separated string, which is much cheaper to pickle and unpickle than a
+    list of Track
+
+    :param provider_name: string registered provider name
+    :param body: bytes raw response body
+    :return: string packed songs for unpack_tracks
+    """
+
+    provider = get_provider(provider_name)(None)
+    return '\0'.join(field for song in provider.parse(provider.decode(body)) for field in song)
+
+
+def unpack_tracks(packed):
+    """ Songs packed by parse_body
+
+    :param packed: string
+    :return: list of Track
+    """
+
+    if not packed:
+        return []
+    fields = packed.split('\0')
+    return list(map(Track, fields[0::2], fields[1::2]))
+
+
+class StationProvider(object):
+    """
+    Base class of the providers, bound to the MediaResources whose client session, metrics and checkpoints it uses
+    """
+
+    name = None
+    # the responses are bounded by both ends of their time window, so the window planner can adapt the widths
+    adaptive = False
+
+    def __init__(self, media_resources):
+        self.media_resources = media_resources
+
+    def default_config(self, steps):
+        """ Station definitions, stored in media_resources.radio_stations under the provider name
+
+        :param steps: int number of time windows fetched per station
+        :return: dict
+        """
+
+        raise NotImplementedError
+
+    @property
+    def config(self):
+        return self.media_resources.radio_stations[self.name]
+
+    def station_names(self):
+        """ Names of the stations of this provider """
+
+        return list(self.config['urls'])
+
+    def decode(self, body):
+        """ Decode a raw response body for parse
+
+        :param body: bytes
+        :return: decoded response
+        """
+
+        return json.loads(body)
+
+    def parse(self, response):
+        """ Songs of a single response
+
+        :param response: decoded response
+        :return: list of Track
+        """
+
+        raise NotImplementedError
+
+    async def fetch_station(self, loop, client, name, song_queue=None):
+        """ Fetch and parse a station, handing each song to media_resources.collect_song
+
+        :param loop: Asyncio event loop
+        :param client: pooled client session
+        :param name: string station name
+        :param song_queue: asyncio.Queue to put the songs on instead of the music list
+        :returns coroutine None
+        """
+
+        raise NotImplementedError
+
+    def job_windows(self, name):
+        """ (since, until) windows a station is split into on the job queue, a single job by default
+
+        :param name: string station name
+        :return: list of tuples of iso formatted time stamps, None for a job that is not a time window
+        """
+
+        return [(None, None)]
+
+    async def fetch_window(self, loop, client, name, since=None, until=None):
+        """ Fetch and parse a single job of the job queue
+
+        :param loop: Asyncio event loop
+        :param client: pooled client session
+        :param name: string station name
+        :param since: string iso formatted start of the window, None for a job that is not a time window
+        :param until: string iso formatted end of the window
+        :returns coroutine list of Track
+        """
+
+        songs = asyncio.Queue()
+        await self.fetch_station(loop, client, name, songs)
+        return [songs.get_nowait() for each_song in range(songs.qsize())]
+
+
+class WindowedJsonProvider(StationProvider):
+    """
+    Stations with a json api queried over time windows walking backward from now
+    """
+
+    adaptive = True
+
+    def window_params(self, params, since, until):
+        """ Set the time window of a copy of the request parameters
+
+        :param params: list of [key, value] parameter lists, already copied
+        :param since: string iso formatted time stamp
+        :param until: string iso formatted time stamp
+        :return: list of parameters
+        """
+
+        return params
+
+    async def fetch_station(self, loop, client, name, song_queue=None):
+        media_resources = self.media_resources
+        config = self.config
+        url = config['urls'][name]
+        headers = dict(config['headers'], Referer=url)
+        checkpoints = media_resources.checkpoints
+        checkpoint = checkpoints.get(name) if checkpoints is not None else None
+        retry_windows = checkpoints.failed_windows(name) if checkpoints is not None else None
+        started = media_resources.timestamp if media_resources.timestamp else \
+            datetime.now().replace(microsecond=0).isoformat()
+        failed = []
+        async for song in media_resources.stream_loop(loop, headers=headers, url=url, params=config['params'],
+                                                      station=self.name, interval=config['interval'], client=client,
+                                                      checkpoint=checkpoint, name=name, failed=failed,
+                                                      retry_windows=retry_windows):
+            await media_resources.collect_song(song, song_queue)
+        if failed:
+            print(name, len(failed), "windows failed, they are fetched again on the next run")
+        # the checkpoint moves once every window was processed, the windows that failed are kept to be retried
+        if checkpoints is not None:
+            checkpoints.update(name, started)
+            checkpoints.set_failed_windows(name, failed)
+
+    def job_windows(self, name):
+        # the windows that failed on a previous run come first, the windows of a queued run do not adapt to the plays
+        media_resources = self.media_resources
+        checkpoints = media_resources.checkpoints
+        checkpoint = checkpoints.get(name) if checkpoints is not None else None
+        ranges = list(checkpoints.failed_windows(name)) if checkpoints is not None else []
+        planners = [media_resources.window_planner(self.config['interval'], station=self.name, since=since,
+                                                   until=until) for since, until in ranges]
+        planners.append(media_resources.window_planner(self.config['interval'], checkpoint, self.name))
+        return [(window.since, window.until) for planner in planners for window in planner.windows()]
+
+    async def fetch_window(self, loop, client, name, since=None, until=None):
+        config = self.config
+        url = config['urls'][name]
+        songs = await self.media_resources.fetch(dict(config['headers'], Referer=url), url, client, config['params'],
+                                                 self.name, until=until, since=since, name=name, parse=True)
+        self.media_resources.metrics.increment('records_parsed', len(songs), name)
+        return songs
+
+
+@register_provider
+class CBSProvider(WindowedJsonProvider):
+    """
+    cbslocal station playlists
+    """
+
+    name = 'cbs_stations'
+    # the requests only send the start of the window as before, every response is a full page
+    adaptive = False
+
+    def default_config(self, steps):
+        return {
+            'params':
+                [['action', 'playlist'], ['type', 'json'], ['before']]
+            ,
+            'headers': {
+                'DNT': '1',
+                'Accept-Encoding': 'gzip, deflate',
+                'Accept-Language': 'en-US,en;q=0.8',
+                'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.90 Safari/537.36',
+                'Accept': '*/*',
+                'Referer': 'http://{}.cbslocal.com/playlist',
+                'X-Requested-With': 'XMLHttpRequest',
+                'Connection': 'keep-alive',
+            },
+            'urls': {
+                'wxrt': 'http://wxrt.cbslocal.com/playlist/',
+                'x1075lasvegas': 'http://x1075.cbslocal.com/playlist',
+                'kroq': 'http://www.roq.com/playlist/',
+                'live105': 'http://www.live.com/playlist/',
+            },
+            'interval': steps * 4,
+        }
+
+    def window_params(self, params, since, until):
+        params[2][1:] = [since]
+        return params
+
+    def parse(self, response):
+        return [Track(each_song['artist'], each_song['title']) for each_song in response['data']['recentEvents']]
+
+
+@register_provider
+class TuneGenieProvider(WindowedJsonProvider):
+    """
+    tunegenie now playing api
+    """
+
+    name = 'tunegenie'
+
+    def default_config(self, steps):
+        return {
+            'params': [['since', '2017-08-08T17:00:00-05:00'], ['until', '2017-08-08T18:59:59-05:00']],
+            'headers': {
+                'DNT': '1',
+                'Accept-Encoding': 'gzip, deflate',
+                'Accept-Language': 'en-US,en;q=0.8',
+                'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36',
+                'Accept': '*/*',
+                'Referer': 'http://{}.tunegenie.com/onair/',
+                'X-Requested-With': 'XMLHttpRequest',
+                'Connection': 'keep-alive',
+            },
+            'urls': {
+                'wwyy': 'http://wwyy.tunegenie.com/api/v1/brand/nowplaying/',
+                'wkqx': 'http://wkqx.tunegenie.com/api/v1/brand/nowplaying/'
+            },
+            'interval': steps * 4,
+            # plays in a full response, inferred from the responses by the window planner when not set
+            'page_size': None,
+        }
+
+    def window_params(self, params, since, until):
+        params[0][1], params[1][1] = since, until
+        return params
+
+    def parse(self, response):
+        return [Track(each_song['artist'], each_song['song']) for each_song in response['response']
+                if not is_branding(each_song['artist'])]
+
+
+@register_provider
+class IHeartProvider(StationProvider):
+    """
+    iheart recently played pages, scraped from their html
+    """
+
+    name = 'iheart'
+
+    def default_config(self, steps):
+        return {
+            'stations': ['star1019', 'dc101'],
+            # 'stations': ['dc101'],
+
+            'data':
+                [['nextPageToken', 'token'], ['template', 'playlist'], ['offset', '0'],
+                 ['limit', '150000'], ],
+            'headers': {
+                'DNT': '1',
+                'Accept-Encoding': 'gzip, deflate',
+                'Accept-Language': 'en-US,en;q=0.8',
+                'Upgrade-Insecure-Requests': '1',
+                'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+                'Cache-Control': 'max-age=0',
+                'Connection': 'keep-alive',
+            },
+            'next_headers': {
+                'origin': 'https://{}.iheart.com',
+                'accept-encoding': 'gzip, deflate, br',
+                'accept-language': 'en-US,en;q=0.8',
+                'x-requested-with': 'XMLHttpRequest',
+                'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36',
+                'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                'accept': 'text/html, */*; q=0.01',
+                'referer': 'https://{}.iheart.com/gmusic/recently-played/',
+                'dnt': '1',
+            },
+            'url': 'https://{}.iheart.com/gmusic/recently-played/',
+            'next_url': 'https://{}.iheart.com/api/gmusic/load_more/',
+            # number of load_more pages to follow after the recently played page
+            'pages': 1,
+            # limit of the load_more requests
+            'interval': steps * 4,
+        }
+
+    def station_names(self):
+        return list(self.config['stations'])
+
+    def alt_songs(self, alts):
+        """ Get the songs from the alt attributes of an iheart page
+
+        :param alts: list of alt strings
+        :returns list of Track
+        """
+
+        songs = []
+        for songinfo in alts:
+            songdetails = songinfo.split(' - ')
+            # alts without an artist are images, not songs
+            if len(songdetails) < 2 or is_branding(songdetails[-1]):
+                continue
+
+            songs.append(Track(songdetails[-1], songdetails[-2]))
+        return songs
+
+    def page_songs(self, content):
+        """ Get the songs and the next page token from an iheart recently played page or load_more response
+
+        :param content: bytes html content
+        :returns tuple of list of Track and string token for the next page, None if there is no next page
+        """
+
+        alts, token = extract_iheart_page(content)
+        return self.alt_songs(alts), token
+
+    def decode(self, body):
+        return body
+
+    def parse(self, response):
+        return self.page_songs(response)[0]
+
+    async def read_songs(self, resp, station='', chunks=None):
+        """ Get the songs and the next page token from an iheart response, parsing the body as it is downloaded
+
+        :param resp: aiohttp client response
+        :param station: string iheart station name for the metrics
+        :param chunks: list the body chunks are appended to, for the response cache and the capture archive
+        :returns coroutine tuple of list of Track and string token for the next page
+        """
+
+        metrics = self.media_resources.metrics
+        extractor = IHeartExtractor()
+        async for chunk in resp.content.iter_chunked(65536):
+            metrics.increment('response_bytes', len(chunk), station)
+            extractor.feed_bytes(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+        extractor.close()
+        songs = self.alt_songs(extractor.alts)
+        metrics.increment('records_parsed', len(songs), station)
+        return songs, extractor.token
+
+    async def fetch_station(self, loop, client, name, song_queue=None):
+        """ Scrape the recently played songs of an iheart station
+
+            The recently played page is fetched first and the load_more pages are then followed through their
+            data-nextpagetoken for up to the configured number of pages. The recently played page is revalidated
+            against the response cache, the load_more pages are always fetched
+        """
+
+        iheart = self.config
+        media_resources = self.media_resources
+        metrics = media_resources.metrics
+        url = iheart['url'].format(name)
+        headers = iheart['headers']
+        cache = media_resources.response_cache
+        capture = media_resources.capture_archive is not None
+        cached = None
+        if cache is not None:
+            cached = cache.get(cache.key(url))
+            headers = dict(headers, **cache.conditional_headers(cached))
+
+        async def page_attempt():
+            async with client.get(url, headers=headers) as resp:
+                if resp.status == 304 and cached is not None:
+                    return None, None, None, None, None
+                check_status(resp)
+                chunks = [] if cache is not None or capture else None
+                songs, token = await self.read_songs(resp, name, chunks)
+                body = b''.join(chunks) if chunks is not None else None
+                return songs, token, body, resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+
+        started = time.perf_counter()
+        songs, token, body, etag, last_modified = await media_resources.request_with_retries(url, page_attempt, name)
+        if songs is None:
+            cache.not_modified(cached)
+            metrics.increment('bytes_saved', len(cached.body), name)
+            songs, token = self.page_songs(cached.body)
+            metrics.increment('records_parsed', len(songs), name)
+            body = cached.body
+        elif cache is not None:
+            cache.set(cache.key(url), body, etag, last_modified)
+        metrics.observe('request_latency_seconds', time.perf_counter() - started, name)
+        metrics.increment('requests', station=name)
+        if capture:
+            media_resources.capture_response(self.name, name, None, None, body)
+        # the page and its load_more pages list the plays latest first, they are counted as a single response
+        played = list(songs)
+        for song in songs:
+            await media_resources.collect_song(song, song_queue)
+
+        next_headers = dict(iheart['next_headers'], origin=iheart['next_headers']['origin'].format(name),
+                            referer=iheart['next_headers']['referer'].format(name))
+        url = iheart['next_url'].format(name)
+        for page in range(iheart['pages']):
+            if not token:
+                break
+            data = [(key, str(value)) for key, value in iheart['data']]
+            data[0] = (data[0][0], token)
+            data[3] = (data[3][0], str(iheart['interval']))
+
+            async def load_more_attempt():
+                async with client.post(url, headers=next_headers, data=data) as resp:
+                    check_status(resp)
+                    chunks = [] if capture else None
+                    songs, token = await self.read_songs(resp, name, chunks)
+                    return songs, token, b''.join(chunks) if chunks is not None else None
+
+            started = time.perf_counter()
+            try:
+                songs, token, body = await media_resources.request_with_retries(url, load_more_attempt, name)
+            except Exception as exc:
+                # the songs of the pages already read are kept
+                metrics.increment('failed_windows', station=name)
+                print(name, "load_more failed", repr(exc))
+                break
+            metrics.observe('request_latency_seconds', time.perf_counter() - started, name)
+            metrics.increment('requests', station=name)
+            if capture:
+                media_resources.capture_response(self.name, name, None, None, body)
+            played.extend(songs)
+            for song in songs:
+                await media_resources.collect_song(song, song_queue)
+        media_resources.count_plays(name, None, None, played)
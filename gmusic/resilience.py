@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.resilience
+~~~~~~~~~~~~~~~~~
+
+This module provides the errors and the per host circuit breaker of the station fetch layer, so that failed requests
+are retried a bounded number of times and a failing station is left alone for a while instead of being hammered
+
+"""
+
+import time
+
+
+class FetchError(Exception):
+    """
+    A station request that failed, retryable for server errors and throttling
+    """
+
+    def __init__(self, url, status=None, retryable=True, message=None):
+        self.url = url
+        self.status = status
+        self.retryable = retryable
+        super(FetchError, self).__init__(message if message else '{} returned {}'.format(url, status))
+
+
+class CircuitOpenError(FetchError):
+    """
+    A request that was not sent because the circuit breaker of its host is open
+    """
+
+    def __init__(self, url, host):
+        super(CircuitOpenError, self).__init__(url, retryable=False,
+                                               message='circuit breaker of {} is open'.format(host))
+
+
+def check_status(resp):
+    """ Raise a FetchError unless a response is a 200
+
+    :param resp: aiohttp client response
+    :return: None
+    """
+
+    if resp.status == 200:
+        return
+    # server errors and throttling are worth retrying, the other statuses will not change
+    raise FetchError(str(resp.url), resp.status, retryable=resp.status >= 500 or resp.status == 429)
+
+
+class CircuitBreaker(object):
+    """
+    Opens after failure_threshold consecutive failures of a host. While open, requests to the host fail right away.
+    After reset_timeout seconds one trial request is let through, its success closes the breaker again and its
+    failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param host: string host name
+        :param failure_threshold: int consecutive failures opening the breaker
+        :param reset_timeout: float seconds the breaker stays open
+        """
+
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def ready(self):
+        """ Check if a request to the host would be let through, without taking the trial of an open breaker
+
+        :return: bool
+        """
+
+        return self.opened is None or (not self.trial and time.monotonic() - self.opened >= self.reset_timeout)
+
+    def allow(self):
+        """ Check if a request to the host can be sent, an open breaker lets one trial request through
+
+        :return: bool
+        """
+
+        if not self.ready():
+            return False
+        if self.opened is not None:
+            self.trial = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.failure_threshold:
+            self.opened = time.monotonic()
+            self.trial = False
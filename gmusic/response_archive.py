@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.response_archive
+~~~~~~~~~~~~~~~~~~~~~~~
+
+This module provides an append-only archive of raw radio station responses. Captured responses are compressed into a
+data file and located through a fixed size record index that is memory mapped on replay, so that months of history
+can be fed through the parsers again without any network traffic
+
+"""
+
+from collections import namedtuple
+import mmap
+import os
+import struct
+import zlib
+
+
+# provider, station, since, until, offset and compressed length of a response, the strings are utf-8 and null padded
+INDEX_RECORD = struct.Struct('<16s32s25s25sQI')
+
+# an archived response, since is empty for the responses that are not a time window
+ArchiveRecord = namedtuple('ArchiveRecord', ['provider', 'station', 'since', 'until', 'offset', 'length'])
+
+
+def pack_field(value, size):
+    encoded = value.encode('utf-8') if value else b''
+    if len(encoded) > size:
+        raise ValueError('{} does not fit in {} bytes of the archive index'.format(value, size))
+    return encoded
+
+
+def unpack_field(value):
+    return value.rstrip(b'\0').decode('utf-8')
+
+
+class ResponseArchive(object):
+    """
+    Directory holding a responses.dat file of zlib compressed responses and an index.dat file of INDEX_RECORD records.
+
+    Opened with mode 'a' the archive is appended to, opened with mode 'r' both files are memory mapped for reading.
+    """
+
+    def __init__(self, directory, mode='r', level=6):
+        """
+        :param directory: string archive directory, created when appending
+        :param mode: string 'a' to capture responses or 'r' to replay them
+        :param level: int zlib compression level of the captured responses
+        """
+
+        if mode not in ('a', 'r'):
+            raise ValueError('mode must be a or r, not {}'.format(mode))
+        self.directory = directory
+        self.mode = mode
+        self.level = level
+        self.data_file = os.path.join(directory, 'responses.dat')
+        self.index_file = os.path.join(directory, 'index.dat')
+
+        if mode == 'a':
+            os.makedirs(directory, exist_ok=True)
+            self.data = open(self.data_file, 'ab')
+            self.index = open(self.index_file, 'ab')
+            # a record cut short by a crash while capturing is dropped, the next ones would be misaligned after it
+            size = os.fstat(self.index.fileno()).st_size
+            if size % INDEX_RECORD.size:
+                self.index.truncate(size - size % INDEX_RECORD.size)
+            self.data_map = self.index_map = None
+        else:
+            self.data = open(self.data_file, 'rb')
+            self.index = open(self.index_file, 'rb')
+            self.data_map = self.map(self.data)
+            self.index_map = self.map(self.index)
+
+    @staticmethod
+    def map(archive_file):
+        size = os.fstat(archive_file.fileno()).st_size
+        return mmap.mmap(archive_file.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+
+    def append(self, provider, station, since, until, body):
+        """ Capture a raw response
+
+        :param provider: string station provider name
+        :param station: string station name
+        :param since: string iso formatted start of the time window, None for the responses that are not a window
+        :param until: string iso formatted end of the time window or time of the capture
+        :param body: bytes raw response body
+        :return: None
+        """
+
+        compressed = zlib.compress(body, self.level)
+        offset = self.data.tell()
+        self.data.write(compressed)
+        # the data is written before the index record so that an index record always points to a whole response
+        self.data.flush()
+        self.index.write(INDEX_RECORD.pack(pack_field(provider, 16), pack_field(station, 32), pack_field(since, 25),
+                                           pack_field(until, 25), offset, len(compressed)))
+        self.index.flush()
+
+    def __len__(self):
+        return len(self.index_map) // INDEX_RECORD.size
+
+    def records(self, providers=None, names=None, since=None, until=None):
+        """ Archived responses in capture order
+
+        :param providers: collection of provider names to keep, every provider if not provided
+        :param names: collection of station names to keep, every station if not provided
+        :param since: string iso formatted time stamp, responses ending before it are skipped
+        :param until: string iso formatted time stamp, responses ending after it are skipped
+        :return: generator of ArchiveRecord
+        """
+
+        # a record cut short by a crash while capturing is ignored
+        for position in range(0, len(self) * INDEX_RECORD.size, INDEX_RECORD.size):
+            fields = INDEX_RECORD.unpack_from(self.index_map, position)
+            record = ArchiveRecord(unpack_field(fields[0]), unpack_field(fields[1]), unpack_field(fields[2]),
+                                   unpack_field(fields[3]), fields[4], fields[5])
+            if providers is not None and record.provider not in providers:
+                continue
+            if names is not None and record.station not in names:
+                continue
+            if (since and record.until < since) or (until and record.until > until):
+                continue
+            yield record
+
+    def find(self, station, since, until):
+        """ Latest archived response of a station for a time window
+
+        :param station: string station name
+        :param since: string iso formatted time stamp
+        :param until: string iso formatted time stamp
+        :return: ArchiveRecord, None if the window was not captured
+        """
+
+        found = None
+        for record in self.records(names=(station,)):
+            if record.since == (since or '') and record.until == until:
+                found = record
+        return found
+
+    def read(self, record):
+        """ Raw body of an archived response
+
+        :param record: ArchiveRecord
+        :return: bytes
+        """
+
+        return zlib.decompress(self.data_map[record.offset:record.offset + record.length])
+
+    def close(self):
+        if self.mode == 'r':
+            for mapped in (self.data_map, self.index_map):
+                if isinstance(mapped, mmap.mmap):
+                    mapped.close()
+        self.data.close()
+        self.index.close()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.response_cache
+~~~~~~~~~~~~~~~~~~~~~
+
+This module provides a sqlite backed cache of radio station responses. Responses for time windows far enough in the
+past do not change and are served from the cache, the others are revalidated with conditional requests so that an
+unchanged response is not downloaded again
+
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import os
+import sqlite3
+import time
+
+
+# a cached response body with the validators it was served with
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'last_modified', 'immutable'])
+
+
+class ResponseCache(object):
+    """
+    Disk backed cache of station responses keyed by url and query parameters.
+
+    Entries are kept for ttl seconds, the cache is bounded to max_entries, the oldest entries being evicted first.
+    """
+
+    def __init__(self, cache_file=None, ttl=7 * 24 * 3600, settle=2 * 3600, max_entries=100000, commit_every=100):
+        """
+        :param cache_file: string sqlite file, ~/.gmusic/response_cache.sqlite if not provided
+        :param ttl: int seconds an entry is kept
+        :param settle: int seconds after which the plays of a time window are not expected to change anymore
+        :param max_entries: int bound of the number of entries
+        :param commit_every: int number of writes between two commits
+        """
+
+        if cache_file:
+            self.cache_file = cache_file
+        else:
+            self.cache_file = os.path.expanduser('~/.gmusic/response_cache.sqlite')
+
+        self.ttl = ttl
+        self.settle = settle
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.writes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        directory = os.path.dirname(self.cache_file)
+        if directory and self.cache_file != ':memory:':
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.cache_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS response_cache ('
+                                'key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT, last_modified TEXT, '
+                                'immutable INTEGER NOT NULL, created REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS response_cache_created ON response_cache (created)')
+        self.connection.commit()
+
+    @staticmethod
+    def key(url, params=None):
+        """ Cache key of a request
+
+        :param url: string
+        :param params: list of [key, value] query parameters
+        :return: string
+        """
+
+        if not params:
+            return url
+        return '?'.join([url, urlencode([tuple(each_param) for each_param in params])])
+
+    def window_immutable(self, until):
+        """ Check if the plays of a time window ending at until can still change
+
+        :param until: string iso formatted time stamp, None for a request that is not a time window
+        :return: bool
+        """
+
+        if not until:
+            return False
+        cutoff = (datetime.now() - timedelta(seconds=self.settle)).replace(microsecond=0).isoformat()
+        return until < cutoff
+
+    def get(self, key):
+        """ Look up a cached response
+
+        :param key: string from key()
+        :return: CachedResponse, None if there is no valid entry
+        """
+
+        row = self.connection.execute('SELECT body, etag, last_modified, immutable, created FROM response_cache '
+                                      'WHERE key = ?', (key,)).fetchone()
+        if row and time.time() - row[4] < self.ttl:
+            return CachedResponse(row[0], row[1], row[2], bool(row[3]))
+        return None
+
+    def conditional_headers(self, cached):
+        """ Headers revalidating a cached response
+
+        :param cached: CachedResponse or None
+        :return: dict
+        """
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        return headers
+
+    def hit(self, cached):
+        """ Count a response served from the cache without a request """
+
+        self.hits += 1
+        self.bytes_saved += len(cached.body)
+
+    def not_modified(self, cached):
+        """ Count a response revalidated by a 304 """
+
+        self.revalidated += 1
+        self.bytes_saved += len(cached.body)
+
+    def set(self, key, body, etag=None, last_modified=None, immutable=False):
+        """ Cache a response
+
+        :param key: string from key()
+        :param body: bytes response body
+        :param etag: string ETag header of the response
+        :param last_modified: string Last-Modified header of the response
+        :param immutable: bool True if the response can be served without revalidation
+        :return: None
+        """
+
+        self.misses += 1
+        self.connection.execute('INSERT OR REPLACE INTO response_cache '
+                                '(key, body, etag, last_modified, immutable, created) VALUES (?, ?, ?, ?, ?, ?)',
+                                (key, body, etag, last_modified, int(immutable), time.time()))
+        self.writes += 1
+        if self.writes % self.commit_every == 0:
+            self.connection.commit()
+
+    def evict(self):
+        """ Remove expired entries and the oldest entries over max_entries
+
+        :return: None
+        """
+
+        self.connection.execute('DELETE FROM response_cache WHERE created < ?', (time.time() - self.ttl,))
+        self.connection.execute('DELETE FROM response_cache WHERE rowid IN ('
+                                'SELECT rowid FROM response_cache ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                                (self.max_entries,))
+        self.connection.commit()
+
+    def report(self):
+        """ Summary of the cache use of the run
+
+        :return: string
+        """
+
+        return 'response cache: {} served, {} not modified, {} downloaded, {} bytes saved'.format(
+            self.hits, self.revalidated, self.misses, self.bytes_saved)
+
+    def close(self):
+        """ Evict, commit and close the cache
+
+        :return: None
+        """
+
+        self.evict()
+        self.connection.close()
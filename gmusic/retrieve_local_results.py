@@ -10,7 +10,10 @@ This module provides helper functions to query and update a Pandas DataFrame
 
 import pandas as pd
 import datetime
-from gmusic.fetch_songs import FetchSongs
+from gmusic.library_index import LibraryIndex
+from gmusic.library_store import LibraryStore
+from gmusic.playlist_planner import PlaylistPlanner
+from gmusic.metrics import NULL_METRICS
 
 
 class QueryUsingPandas(object):
@@ -22,22 +25,62 @@ class QueryUsingPandas(object):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+        if not getattr(self, 'metrics', None):
+            self.metrics = NULL_METRICS
+
         if hasattr(self, 'google_music_json_file'):
             if not self.google_music_json_file:
                 self.google_music_json_file = '/home/ark/work/Misc/google_music_content_new.json'
 
+        if hasattr(self, 'library_file'):
+            if not self.library_file:
+                self.library_file = '/home/ark/work/Misc/google_music_content.sqlite'
+            self.library_store = LibraryStore(self.library_file)
+            # the json library is imported once, the first time the store is used
+            if hasattr(self, 'google_music_json_file'):
+                self.library_store.migrate_from_json(self.google_music_json_file)
+
         if hasattr(self, 'name'):
             if not self.name:
                 self.name = ''.join(['Alt-Radio-Station-', datetime.datetime.now().strftime('%m%d%Y%H%M%S%f')])
 
-    def load_and_save_pandas_dataframe(self, load_or_save=None, dataframe=None):
-        if load_or_save == 'load':
-            return pd.read_json(self.google_music_json_file)
-        elif load_or_save == 'save':
-            dataframe.to_json(self.google_music_json_file)
+    def load_and_save_pandas_dataframe(self, load_or_save=None, dataframe=None, song_list=None, columns=None):
+        """Load the library, or save it to disk. With a library store the new songs are appended to it instead of
+        rewriting the whole library
+
+        :param load_or_save: string 'load', 'save' or 'append'
+        :param dataframe: pandas dataframe to save
+        :param song_list: list of songs to append
+        :param columns: list of column names to load, only supported by the library store
+        :return: pandas dataframe when loading
+        """
+
+        library_store = getattr(self, 'library_store', None)
+        with self.metrics.time(''.join(['library_', str(load_or_save)])):
+            if load_or_save == 'load':
+                if library_store is not None:
+                    return library_store.load(columns=columns)
+                return pd.read_json(self.google_music_json_file)
+            elif load_or_save == 'save':
+                dataframe.to_json(self.google_music_json_file)
+            elif load_or_save == 'append':
+                if library_store is not None:
+                    library_store.append(song_list)
+                else:
+                    self.append_to_pandas_dataframe(self.load_and_save_pandas_dataframe(load_or_save='load'),
+                                                    song_list).to_json(self.google_music_json_file)
+
+    def build_library_index(self, dataframe):
+        """Build a hash indexed view of the dataframe to be used for song lookups"""
+
+        with self.metrics.time('library_index'):
+            return LibraryIndex.from_dataframe(dataframe)
 
     @classmethod
-    def check_song_in_pandas_dataframe(self, dataframe, artist, song):
+    def check_song_in_pandas_dataframe(self, dataframe, artist, song, library_index=None):
+        if library_index is not None:
+            return library_index.contains(artist, song)
+
         if ((dataframe.artist.str.contains(artist, case=False)) & (
                 dataframe.title.str.contains(song, case=False))).any():
             return True
@@ -45,63 +88,18 @@ class QueryUsingPandas(object):
             return False
 
     @classmethod
-    def playlists_with_available_space(self, dataframe):
-        """This method will calculate the playlist available space for songs"""
-
-        unique_playlists = dataframe.playlist_id.unique()
-        for playlist in unique_playlists:
-            playlist_song_count = dataframe.playlist_id.value_counts()[playlist]
-            if playlist_song_count < 800:
-                yield(playlist, playlist_song_count)
-            else:
-                return None
-
-    @classmethod
-    def get_playlist(self, dataframe=None, remaining_songs=None, new_music_list=None, playlist=None, name=None):
-        """
+    def get_playlist_planner(self, dataframe):
+        """Count the songs in each playlist once and return a planner to assign new songs to the playlists
 
         :param dataframe: pandas dataframe
-        :param remaining_songs: To be used only by the recursive call
-        :param new_music_list: List of songs as input to calculate the space required in the playlists
-        :param playlist: To be used exclusively by the recursive call (similar to the remaining_songs param above)
-        :return:
+        :return: PlaylistPlanner
         """
-        song_set = remaining_songs if remaining_songs else len(new_music_list)
-
-        if playlist:
-
-            if remaining_songs > 800:
-                yield (playlist, 800)
-                remaining_songs = remaining_songs - 800
-                yield from self.get_playlist(remaining_songs=remaining_songs, playlist=FetchSongs.create_gmusic_playlist(self.name))
-            else:
-
-                yield (playlist, remaining_songs)
-
-        else:
-            for each_returned_list in self.playlists_with_available_space(dataframe):
 
-                if each_returned_list:
-                    available_slots = 800 - each_returned_list[1]
-
-                if available_slots:
-
-                    if song_set >= available_slots:
-                        remaining_songs = song_set - available_slots
-                    else:
-                        available_slots = song_set
-                        remaining_songs = 0
-
-                    yield (each_returned_list[0], available_slots)
-
-                if remaining_songs:
-                    song_set = remaining_songs
-                else:
-                    break
-            else:
-                if remaining_songs:
-                    yield from self.get_playlist(remaining_songs=remaining_songs, playlist=FetchSongs.create_gmusic_playlist(self.name))
+        return PlaylistPlanner.from_dataframe(dataframe)
 
     @classmethod
-    def append_to_pandas_dataframe(self, dataframe, song_list):
-        return dataframe.append(pd.DataFrame(song_list, columns=['artist', 'title', 'nid', 'timestamp', 'playlist_id']), ignore_index=True)
+    def append_to_pandas_dataframe(self, dataframe, song_list, library_index=None):
+        if library_index is not None:
+            library_index.add_songs(song_list)
+        return pd.concat([dataframe, pd.DataFrame(song_list, columns=['artist', 'title', 'nid', 'timestamp', 'playlist_id'])],
+                         ignore_index=True)
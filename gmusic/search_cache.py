@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.search_cache
+~~~~~~~~~~~~~~~~~~~
+
+This module provides a sqlite backed cache of GMUSIC API search results so that songs which were already
+searched for on a previous run, found or not, do not need another round trip to the API
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from gmusic.library_index import normalize_key
+
+
+# returned by SearchCache.get when nothing usable is cached for a song
+MISSING = object()
+
+
+class SearchCache(object):
+    """
+    Disk backed cache of song store ids keyed by the normalized (artist, title).
+
+    Songs that were not found are cached as well with their own, shorter, time to live so that they are searched
+    for again once in a while. The cache is bounded to max_entries, the oldest entries being evicted first.
+    """
+
+    def __init__(self, cache_file=None, ttl=30 * 24 * 3600, not_found_ttl=3 * 24 * 3600, max_entries=100000,
+                 evict_every=1000):
+        if cache_file:
+            self.cache_file = cache_file
+        else:
+            self.cache_file = os.path.expanduser('~/.gmusic/search_cache.sqlite')
+
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.cache_file)
+        if directory and self.cache_file != ':memory:':
+            os.makedirs(directory, exist_ok=True)
+        # the cache is shared by the search workers of the pipeline, the lock serializes their access
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.cache_file, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS search_cache ('
+                                'artist TEXT NOT NULL, title TEXT NOT NULL, store_id TEXT, created REAL NOT NULL, '
+                                'PRIMARY KEY (artist, title))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS search_cache_created ON search_cache (created)')
+        self.connection.commit()
+
+    def get(self, artist, title):
+        """ Look up a cached search result
+
+        :param artist: string
+        :param title: string
+        :return: string store id, None if the song is cached as not found or MISSING if there is no valid entry
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT store_id, created FROM search_cache WHERE artist = ? AND title = ?',
+                                          (normalize_key(artist), normalize_key(title))).fetchone()
+            if row:
+                store_id, created = row
+                ttl = self.ttl if store_id is not None else self.not_found_ttl
+                if time.time() - created < ttl:
+                    self.hits += 1
+                    return store_id
+            self.misses += 1
+            return MISSING
+
+    def set(self, artist, title, store_id):
+        """ Cache a search result
+
+        :param artist: string
+        :param title: string
+        :param store_id: string store id or None if the song was not found
+        :return: None
+        """
+
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO search_cache (artist, title, store_id, created) '
+                                    'VALUES (?, ?, ?, ?)',
+                                    (normalize_key(artist), normalize_key(title), store_id, time.time()))
+            self.connection.commit()
+            self.writes += 1
+            evict = self.writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """ Remove expired entries and the oldest entries over max_entries
+
+        :return: None
+        """
+
+        now = time.time()
+        with self.lock:
+            self.connection.execute('DELETE FROM search_cache WHERE (store_id IS NULL AND created < ?) OR created < ?',
+                                    (now - self.not_found_ttl, now - self.ttl))
+            self.connection.execute('DELETE FROM search_cache WHERE rowid IN ('
+                                    'SELECT rowid FROM search_cache ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                                    (self.max_entries,))
+            self.connection.commit()
+
+    def close(self):
+        """ Evict and close the cache
+
+        :return: None
+        """
+
+        self.evict()
+        self.connection.close()
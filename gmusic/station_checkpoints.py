@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.station_checkpoints
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This module keeps track of the newest time stamp already fetched for each radio station, of the time windows that
+failed and of the songs that could not be added to the playlists, so that repeated runs only query the time windows
+that were not processed yet and still add every song they found
+
+"""
+
+import json
+import os
+
+
+class StationCheckpoints(object):
+    """
+    Small json backed store of the newest processed time stamp and the failed time windows keyed by station name, and
+    of the found songs waiting to be added to the playlists
+    """
+
+    def __init__(self, checkpoint_file=None):
+        if checkpoint_file:
+            self.checkpoint_file = checkpoint_file
+        else:
+            self.checkpoint_file = os.path.expanduser('~/.gmusic/station_checkpoints.json')
+
+        self.checkpoints = {}
+        self.failed = {}
+        self.pending = []
+        # stations whose time stamp and failed windows are saved as they were when they were held
+        self.held = {}
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            # files written before the failed windows were tracked only hold the time stamps
+            if isinstance(saved.get('checkpoints'), dict):
+                self.checkpoints = saved['checkpoints']
+                self.failed = saved.get('failed_windows', {})
+                self.pending = saved.get('pending_songs', [])
+            else:
+                self.checkpoints = saved
+
+    def get(self, station):
+        """ Get the newest time stamp processed for a station
+
+        :param station: string station name
+        :return: string iso formatted time stamp or None if the station was never processed
+        """
+
+        return self.checkpoints.get(station)
+
+    def update(self, station, timestamp):
+        """ Record a time stamp for a station if it is newer than the one already recorded
+
+        :param station: string station name
+        :param timestamp: string iso formatted time stamp
+        :return: None
+        """
+
+        current = self.checkpoints.get(station)
+        if current is None or timestamp > current:
+            self.checkpoints[station] = timestamp
+
+    def failed_windows(self, station):
+        """ Get the time windows of a station that failed on the previous run
+
+        :param station: string station name
+        :return: list of [since, until] iso formatted time stamps
+        """
+
+        return self.failed.get(station, [])
+
+    def set_failed_windows(self, station, windows):
+        """ Replace the failed time windows of a station
+
+        :param station: string station name
+        :param windows: list of (since, until) iso formatted time stamps
+        :return: None
+        """
+
+        if windows:
+            self.failed[station] = [list(window) for window in windows]
+        else:
+            self.failed.pop(station, None)
+
+    def hold(self, station):
+        """ Keep saving the current time stamp and failed windows of a station until it is released, while the
+        songs of the windows fetched after them are not added or pending yet
+
+        :param station: string station name
+        :return: None
+        """
+
+        self.held[station] = (self.checkpoints.get(station), list(self.failed.get(station, [])))
+
+    def release(self, station, keep=True):
+        """ Stop holding a station
+
+        :param station: string station name
+        :param keep: bool keep the time stamp and failed windows recorded since hold, put back the held ones if False
+        :return: None
+        """
+
+        timestamp, windows = self.held.pop(station)
+        if keep:
+            return
+        if timestamp is None:
+            self.checkpoints.pop(station, None)
+        else:
+            self.checkpoints[station] = timestamp
+        self.set_failed_windows(station, windows)
+
+    def pending_songs(self):
+        """ Get the songs that were found but could not be added to the playlists on a previous run
+
+        :return: list of [artist, title, song id, timestamp] lists
+        """
+
+        return [list(each_song_list) for each_song_list in self.pending]
+
+    def set_pending_songs(self, song_list):
+        """ Replace the songs waiting to be added to the playlists
+
+        :param song_list: list of [artist, title, song id, timestamp] lists, a playlist id after them is dropped
+        :return: None
+        """
+
+        self.pending = [list(each_song_list[:4]) for each_song_list in song_list]
+
+    def save(self):
+        """ Write the checkpoints to disk, replacing the previous file atomically
+
+        :return: None
+        """
+
+        directory = os.path.dirname(self.checkpoint_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        checkpoints, failed = dict(self.checkpoints), dict(self.failed)
+        for station, (timestamp, windows) in self.held.items():
+            checkpoints.pop(station, None)
+            failed.pop(station, None)
+            if timestamp is not None:
+                checkpoints[station] = timestamp
+            if windows:
+                failed[station] = windows
+        temp_file = ''.join([self.checkpoint_file, '.tmp'])
+        with open(temp_file, 'w') as checkpoint_file:
+            json.dump({'checkpoints': checkpoints, 'failed_windows': failed, 'pending_songs': self.pending},
+                      checkpoint_file, indent=2, sort_keys=True)
+        os.replace(temp_file, self.checkpoint_file)
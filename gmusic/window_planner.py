@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmusic.window_planner
+~~~~~~~~~~~~~~~~~~~~~
+
+This module splits the history of a station into contiguous, non-overlapping (since, until) windows walking backward
+from now. The width of the windows follows the number of plays the previous windows returned and the walk stops once
+the history of the station runs out
+
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+# a planned time window, index 0 being the most recent one
+Window = namedtuple('Window', ['index', 'since', 'until'])
+
+# windows are aligned on multiples of their width counted from this origin, so that the past windows of two runs
+# are the same requests and can be served by the response cache
+ORIGIN = datetime(2000, 1, 1)
+
+
+class WindowPlanner(object):
+    """
+    Plans the windows of a station between start and end.
+
+    Window widths are a power of two multiple of base, between base and maximum, and every window but the first and
+    the last starts on a multiple of its own width. A window returning page_size plays or more may have been
+    truncated, it is planned again as two halves and the next windows are half as wide. A window returning less than
+    a quarter of page_size plays, or none when page_size is not known, makes the next windows twice as wide.
+
+    When page_size is not known it is inferred: the largest number of plays, once windows of two different widths
+    returned it, is where the responses are cut. A planner that is not adaptive keeps its widths, for the stations
+    whose responses are not bounded by both ends of the window.
+    """
+
+    def __init__(self, end, start, width, base=timedelta(minutes=15), maximum=None, page_size=None, empty_limit=3,
+                 lookahead=None, adaptive=True):
+        """
+        :param end: datetime end of the most recent window
+        :param start: datetime start of the oldest window
+        :param width: timedelta width of the first windows
+        :param base: timedelta smallest window width
+        :param maximum: timedelta largest window width, width if not provided
+        :param page_size: int number of plays of a full response, inferred from the responses if not provided
+        :param empty_limit: int number of consecutive empty windows after which the history is over
+        :param lookahead: int number of windows planned ahead of the recorded ones, no limit if not provided
+        :param adaptive: bool adapt the widths to the plays, split full windows and infer page_size
+        """
+
+        self.end = end
+        self.start = start
+        self.base = base
+        self.maximum = self.dyadic(maximum if maximum else width)
+        self.width = min(self.dyadic(width), self.maximum)
+        self.page_size = page_size
+        # (since, until) of the windows that returned each number of plays, to infer page_size
+        self.returned = {}
+        self.empty_limit = empty_limit
+        self.lookahead = lookahead
+        self.adaptive = adaptive
+
+        # end of the next window planned by walking backward
+        self.cursor = end
+        self.index = 0
+        self.outstanding = 0
+        self.empty = set()
+        # saturated windows waiting to be planned again as two halves
+        self.splits = []
+        self.exhausted = False
+
+    def dyadic(self, width):
+        """ Largest power of two multiple of base not wider than width """
+
+        dyadic = self.base
+        while dyadic * 2 <= width:
+            dyadic *= 2
+        return dyadic
+
+    def aligned_since(self, until, width):
+        """ Start of the window ending at until, on a multiple of the window width """
+
+        offset = (until - ORIGIN) % width
+        return until - (offset if offset else width)
+
+    @property
+    def done(self):
+        return not self.splits and (self.exhausted or self.cursor <= self.start)
+
+    def plan(self, since, until):
+        window = Window(self.index, since.isoformat(), until.isoformat())
+        self.index += 1
+        self.outstanding += 1
+        return window
+
+    def next_window(self):
+        """ Plan the next window
+
+        :return: Window, None if there are no more windows or lookahead windows are waiting to be recorded
+        """
+
+        if self.splits:
+            since, until = self.splits.pop()
+            return self.plan(since, until)
+        if self.done or (self.lookahead and self.outstanding >= self.lookahead):
+            return None
+
+        until = self.cursor
+        width = self.width
+        # a wider window has to wait for an end aligned on its width
+        while width > self.base and (until - ORIGIN) % width and until != self.end:
+            width /= 2
+        since = max(self.aligned_since(until, width), self.start)
+        self.cursor = since
+        return self.plan(since, until)
+
+    def record(self, window, plays):
+        """ Adapt the next windows to the number of plays a window returned
+
+        :param window: Window from next_window
+        :param plays: int, None if the window failed
+        :return: None
+        """
+
+        self.outstanding -= 1
+        if plays is None:
+            return
+        if self.adaptive:
+            self.adapt(window, plays)
+
+        if plays:
+            return
+        self.empty.add(window.index)
+        # the history is over once empty_limit consecutive windows, walking backward, are empty
+        for index in range(window.index - self.empty_limit + 1, window.index + 1):
+            if all(each in self.empty for each in range(index, index + self.empty_limit)):
+                self.exhausted = True
+                break
+
+    def adapt(self, window, plays):
+        """ Split a full window and change the width of the next windows
+
+        :param window: Window from next_window
+        :param plays: int
+        :return: None
+        """
+
+        since, until = datetime.fromisoformat(window.since), datetime.fromisoformat(window.until)
+        if not self.page_size and plays:
+            self.infer_page_size(plays, since, until)
+        if self.page_size and plays >= self.page_size:
+            self.split(since, until)
+            self.width = max(self.width / 2, self.base)
+        elif plays < (self.page_size // 4 if self.page_size else 1):
+            self.width = min(self.width * 2, self.maximum)
+
+    def split(self, since, until):
+        """ Plan a window again as two halves
+
+        :param since: datetime start of the window
+        :param until: datetime end of the window
+        :return: None
+        """
+
+        middle = self.aligned_since(until, self.dyadic((until - since) / 2))
+        if since < middle < until:
+            self.splits.extend([(since, middle), (middle, until)])
+
+    def infer_page_size(self, plays, since, until):
+        """ Take the largest number of plays as page_size once windows of different widths returned it, the windows
+        recorded before that returned it are split too
+
+        :param plays: int plays of a window
+        :param since: datetime start of the window
+        :param until: datetime end of the window
+        :return: None
+        """
+
+        returned = self.returned.setdefault(plays, [])
+        if plays != max(self.returned) or len({end - start for start, end in returned + [(since, until)]}) < 2:
+            returned.append((since, until))
+            return
+        self.page_size = plays
+        for start, end in returned:
+            self.split(start, end)
+        self.returned = {}
+
+    def remaining(self):
+        """ Windows not planned yet, as (since, until) ranges
+
+        :return: list of tuples of iso formatted time stamps
+        """
+
+        ranges = [(since.isoformat(), until.isoformat()) for since, until in self.splits]
+        if not self.exhausted and self.cursor > self.start:
+            ranges.append((self.start.isoformat(), self.cursor.isoformat()))
+        return ranges
+
+    def windows(self):
+        """ Every window between start and end without adapting, for runs that fetch them all at once
+
+        :return: generator of Window
+        """
+
+        while True:
+            window = self.next_window()
+            if window is None:
+                return
+            self.outstanding -= 1
+            yield window
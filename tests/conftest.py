@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture
+def station_server():
+    """ Local station server answering every request with 20 songs """
+
+    from station_server import StationServer
+
+    server = StationServer(songs_per_response=20, seed=0).start()
+    yield server
+    server.stop()
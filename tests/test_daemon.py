@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+from gmusic.daemon import GmusicDaemon
+from gmusic.library_index import LibraryIndex
+from gmusic.providers import Track
+from gmusic.station_checkpoints import StationCheckpoints
+
+
+class FakeMediaResources(object):
+    """ Moves the checkpoint of the station like fetch_station and scrapes a song, the first scrape fails after it """
+
+    play_counts = None
+    response_cache = None
+
+    def __init__(self, station_checkpoints):
+        self.station_checkpoints = station_checkpoints
+        self.scrapes = 0
+
+    async def run_stations(self, loop, stations=None, song_queue=None, names=None, client=None):
+        self.scrapes += 1
+        self.station_checkpoints.update('wxrt', '2026-10-18T{:02d}:00:00'.format(self.scrapes))
+        if self.scrapes == 1:
+            # another station saving its poll while this one is still searching
+            self.station_checkpoints.save()
+            raise ConnectionError('scrape failed')
+        await song_queue.put(Track('Artist', 'Title'))
+        return {}
+
+
+class FakeFetch(object):
+
+    def __init__(self):
+        self.added = []
+
+    def search_for_songs(self, artist, title):
+        return 'nid'
+
+    def add_songs_to_planned_playlists(self, song_list, playlist_planner, name):
+        self.added.extend(song_list)
+        return song_list
+
+
+class FakePandas(object):
+
+    name = 'gmusic'
+
+    def load_and_save_pandas_dataframe(self, load_or_save=None, song_list=None):
+        pass
+
+
+def test_failed_poll_keeps_the_checkpoint(tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoints.json')
+    station_checkpoints = StationCheckpoints(checkpoint_file)
+    station_checkpoints.update('wxrt', '2026-10-17T00:00:00')
+    fetch = FakeFetch()
+    daemon = GmusicDaemon(FakeMediaResources(station_checkpoints), fetch, FakePandas(), LibraryIndex(), None,
+                          station_checkpoints)
+
+    async def poll_twice():
+        daemon.update_lock = asyncio.Lock()
+        daemon.rate_limiter = None
+        try:
+            await daemon.poll(asyncio.get_event_loop(), None, 'cbs_stations', 'wxrt')
+        except ConnectionError:
+            pass
+        with open(checkpoint_file) as saved:
+            saved_checkpoint = json.load(saved)['checkpoints']['wxrt']
+        restored_checkpoint = station_checkpoints.get('wxrt')
+        await daemon.poll(asyncio.get_event_loop(), None, 'cbs_stations', 'wxrt')
+        return saved_checkpoint, restored_checkpoint
+
+    saved_checkpoint, restored_checkpoint = asyncio.run(poll_twice())
+    assert saved_checkpoint == '2026-10-17T00:00:00'
+    assert restored_checkpoint == '2026-10-17T00:00:00'
+    assert [each_song[:3] for each_song in fetch.added] == [['Artist', 'Title', 'nid']]
+    assert StationCheckpoints(checkpoint_file).get('wxrt') == '2026-10-18T02:00:00'
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from gmusic.library_index import LibraryIndex, normalize_key
+
+
+def library_index():
+    index = LibraryIndex()
+    index.add_songs([('The Black Keys', 'Lonely Boy'), ('Foo Fighters', 'Everlong (Acoustic)'), ('Beck', 'Loser')])
+    return index
+
+
+def test_normalize_key():
+    assert normalize_key('  The   Black\tKeys ') == 'the black keys'
+    assert normalize_key(float('nan')) == ''
+
+
+def test_exact_match():
+    index = library_index()
+    assert index.contains('the black keys', 'LONELY BOY')
+    assert len(index) == 3
+
+
+def test_substring_match():
+    index = library_index()
+    assert index.contains('Black Keys', 'Lonely')
+    assert index.contains('Foo Fighters', 'Everlong')
+    # shorter than the n-grams, every song is a candidate
+    assert index.contains('Be', 'Lo')
+
+
+def test_library_song_must_contain_both_values():
+    index = library_index()
+    assert not index.contains('Black Keys', 'Loser')
+    assert not index.contains('The Black Keys', 'Lonely Boy Remix')
+    assert not index.contains('Arcade Fire', 'Everlong')
+
+
+def test_duplicates_are_indexed_once():
+    index = library_index()
+    index.add_song('Beck', ' loser ')
+    assert len(index) == 3
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from gmusic.normalize import clean_words, is_branding, normalize_song, normalize_songs
+
+
+def test_filtered_words_are_removed():
+    assert clean_words(['Everlong (Acoustic)', 'Song [Live] feat+ Artist', '**Hit**  Single']) == \
+        ['Everlong', 'Song Artist', 'Single']
+
+
+def test_newlines_in_a_value_do_not_shift_the_batch():
+    assert clean_words(['Two\nLines', 'Next']) == ['Two Lines', 'Next']
+
+
+def test_branding_and_duplicates_are_dropped():
+    songs = normalize_songs([('Beck', 'Loser'), ('iHeartRadio', 'Listen'), ('BECK', 'loser (Live)'),
+                             ('Weekdays, 6am', 'Morning Show'), ('Artist', 'Title ??')])
+    assert [(song.artist, song.title, song.key) for song in songs] == [('Beck', 'Loser', ('beck', 'loser'))]
+    assert is_branding('STATION_LOGO')
+
+
+def test_single_song():
+    assert normalize_song('Foo  Fighters', 'Everlong (Acoustic)').key == ('foo fighters', 'everlong')
+    assert normalize_song('iHeartRadio', 'Listen') is None
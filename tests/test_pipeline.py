@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+from gmusic.library_index import LibraryIndex
+from gmusic.pipeline import SongPipeline
+from gmusic.providers import Track
+
+
+class FakeMediaResources(object):
+    """ Scrapes a fixed list of songs """
+
+    play_counts = None
+
+    def __init__(self, songs):
+        self.songs = songs
+
+    async def run_stations(self, loop, stations=None, song_queue=None, names=None, client=None):
+        for song in self.songs:
+            await song_queue.put(song)
+        return {}
+
+
+class FakeFetch(object):
+    """ Finds every song but the ones listed in failing, whose search raises """
+
+    def __init__(self, failing=()):
+        self.failing = failing
+
+    def search_for_songs(self, artist, title):
+        if title in self.failing:
+            raise ConnectionError('search failed')
+        return 'nid-{}'.format(title)
+
+
+SONGS = [Track('Artist {}'.format(i), 'Title {}'.format(i)) for i in range(20)]
+
+
+def run(pipeline):
+    async def run_pipeline():
+        song_list = await pipeline.run(asyncio.get_event_loop())
+        return song_list, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    return asyncio.run(run_pipeline())
+
+
+def test_every_new_song_is_searched_for():
+    library_index = LibraryIndex()
+    library_index.add_song('Artist 0', 'Title 0')
+    song_list, _ = run(SongPipeline(FakeMediaResources(SONGS), FakeFetch(), library_index))
+    assert sorted(each_song[2] for each_song in song_list) == sorted('nid-Title {}'.format(i) for i in range(1, 20))
+
+
+def test_failed_search_is_treated_as_not_found():
+    song_list, tasks = run(SongPipeline(FakeMediaResources(SONGS), FakeFetch({'Title 3', 'Title 7'}), LibraryIndex()))
+    assert len(song_list) == 18
+    assert not {'nid-Title 3', 'nid-Title 7'} & {each_song[2] for each_song in song_list}
+    assert tasks == []
+
+
+def test_failed_stage_cancels_the_others():
+    class FailingLibraryIndex(LibraryIndex):
+        def contains_key(self, key):
+            raise RuntimeError('library check failed')
+
+    async def run_pipeline():
+        with pytest.raises(RuntimeError):
+            await SongPipeline(FakeMediaResources(SONGS), FakeFetch(), FailingLibraryIndex()).run(
+                asyncio.get_event_loop())
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run_pipeline()) == []
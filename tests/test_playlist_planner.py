@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from gmusic.playlist_planner import PlaylistAllocation, PlaylistPlanner
+
+
+def test_fullest_playlists_are_filled_first():
+    planner = PlaylistPlanner({'a': 5, 'b': 8, 'c': 10}, capacity=10)
+    assert planner.available_space() == [('b', 2), ('a', 5)]
+    assert planner.plan(4) == [PlaylistAllocation('b', 0, 2, False), PlaylistAllocation('a', 2, 4, False)]
+
+
+def test_new_playlists_take_the_songs_left():
+    planner = PlaylistPlanner({'a': 7}, capacity=10)
+    assert planner.plan(25) == [PlaylistAllocation('a', 0, 3, False), PlaylistAllocation(None, 3, 13, True),
+                                PlaylistAllocation(None, 13, 23, True), PlaylistAllocation(None, 23, 25, True)]
+
+
+def test_allocations_cover_the_batch():
+    planner = PlaylistPlanner({'a': 3, 'b': 9, 'c': 1}, capacity=10)
+    allocations = planner.plan(30)
+    assert allocations[0].start == 0
+    assert allocations[-1].stop == 30
+    for previous, allocation in zip(allocations, allocations[1:]):
+        assert previous.stop == allocation.start
+    assert all(allocation.stop - allocation.start <= 10 for allocation in allocations)
+
+
+def test_added_songs_use_up_the_space():
+    planner = PlaylistPlanner({'a': 7}, capacity=10)
+    planner.add('a', 3)
+    planner.add('b', 4)
+    assert planner.available_space() == [('b', 6)]
+    assert planner.plan(0) == []
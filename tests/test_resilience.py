@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+import pytest
+
+from gmusic.media_resources import MediaResources
+from gmusic.resilience import CircuitBreaker, CircuitOpenError, FetchError
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('host', failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.ready()
+    assert not breaker.allow()
+
+
+def test_open_breaker_lets_a_single_trial_through():
+    breaker = CircuitBreaker('host', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.1)
+    assert breaker.ready()
+    assert breaker.allow()
+    assert not breaker.ready()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker('host', failure_threshold=5, reset_timeout=0.05)
+    for failure in range(5):
+        breaker.record_failure()
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+
+
+def attempts(*results):
+    """ Coroutine function returning or raising each of results in turn, and the list of calls it got """
+
+    calls = []
+
+    async def attempt():
+        calls.append(len(calls))
+        result = results[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return attempt, calls
+
+
+def request(media_resources, attempt):
+    return asyncio.run(media_resources.request_with_retries('http://station/playlist', attempt))
+
+
+def test_server_errors_are_retried():
+    media_resources = MediaResources(retries=3, backoff=0.001)
+    attempt, calls = attempts(FetchError('url', 500), asyncio.TimeoutError(), 'body')
+    assert request(media_resources, attempt) == 'body'
+    assert len(calls) == 3
+    assert media_resources.breaker('http://station/').failures == 0
+
+
+def test_client_errors_are_not_retried():
+    media_resources = MediaResources(retries=3, backoff=0.001)
+    attempt, calls = attempts(FetchError('url', 404, retryable=False))
+    with pytest.raises(FetchError):
+        request(media_resources, attempt)
+    assert len(calls) == 1
+
+
+def test_retries_stop_once_the_breaker_opens():
+    media_resources = MediaResources(retries=5, backoff=0.001, breaker_threshold=2)
+    attempt, calls = attempts(*[FetchError('url', 503)] * 6)
+    with pytest.raises(CircuitOpenError):
+        request(media_resources, attempt)
+    assert len(calls) == 2
+    with pytest.raises(CircuitOpenError):
+        request(media_resources, attempts('body')[0])
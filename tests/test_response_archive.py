@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from gmusic.response_archive import ResponseArchive
+
+
+def capture(directory, responses):
+    archive = ResponseArchive(directory, 'a')
+    for response in responses:
+        archive.append(*response)
+    archive.close()
+
+
+def test_round_trip(tmp_path):
+    capture(str(tmp_path), [('cbs_stations', 'wxrt', '2026-10-18T00:00:00', '2026-10-18T04:00:00', b'{"a": 1}'),
+                            ('iheart', 'kroq', None, '2026-10-18T05:00:00', b'<html></html>')])
+    archive = ResponseArchive(str(tmp_path))
+    records = list(archive.records())
+    assert len(archive) == 2
+    assert [(record.provider, record.station, record.since) for record in records] == \
+        [('cbs_stations', 'wxrt', '2026-10-18T00:00:00'), ('iheart', 'kroq', '')]
+    assert [archive.read(record) for record in records] == [b'{"a": 1}', b'<html></html>']
+    assert archive.find('wxrt', '2026-10-18T00:00:00', '2026-10-18T04:00:00') == records[0]
+    assert list(archive.records(providers=('iheart',))) == records[1:]
+    archive.close()
+
+
+def test_partial_record_is_dropped_before_the_next_capture(tmp_path):
+    capture(str(tmp_path), [('cbs_stations', 'wxrt', '2026-10-18T00:00:00', '2026-10-18T04:00:00', b'first')])
+    with open(str(tmp_path / 'index.dat'), 'ab') as index:
+        index.write(b'partial')
+    archive = ResponseArchive(str(tmp_path))
+    assert len(archive) == 1
+    archive.close()
+    capture(str(tmp_path), [('cbs_stations', 'kroq', '2026-10-18T00:00:00', '2026-10-18T04:00:00', b'second')])
+    archive = ResponseArchive(str(tmp_path))
+    records = list(archive.records())
+    assert [(record.provider, record.station) for record in records] == [('cbs_stations', 'wxrt'),
+                                                                          ('cbs_stations', 'kroq')]
+    assert [archive.read(record) for record in records] == [b'first', b'second']
+    archive.close()
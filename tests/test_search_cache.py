@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from gmusic.search_cache import MISSING, SearchCache
+
+
+class FakeApi(object):
+    """ Mobileclient stand in answering the searches from a dict of query to (artist, title, store id) hits """
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.searches = []
+
+    def search(self, query):
+        self.searches.append(query)
+        return {'song_hits': [{'track': {'artist': artist, 'title': title, 'storeId': store_id}}
+                              for artist, title, store_id in self.hits.get(query, [])]}
+
+
+@pytest.fixture
+def search_cache(tmp_path):
+    cache = SearchCache(str(tmp_path / 'search_cache.sqlite'))
+    yield cache
+    cache.connection.close()
+
+
+def test_lookups_are_normalized(search_cache):
+    assert search_cache.get('Artist', 'Title') is MISSING
+    search_cache.set('Artist', 'Title', 'nid')
+    assert search_cache.get(' artist ', 'TITLE') == 'nid'
+    assert (search_cache.hits, search_cache.misses) == (1, 1)
+
+
+def test_not_found_songs_expire_sooner(search_cache):
+    search_cache.not_found_ttl = 0.05
+    search_cache.set('Artist', 'Title', None)
+    search_cache.set('Other', 'Title', 'nid')
+    assert search_cache.get('Artist', 'Title') is None
+    time.sleep(0.1)
+    assert search_cache.get('Artist', 'Title') is MISSING
+    assert search_cache.get('Other', 'Title') == 'nid'
+
+
+def test_evict_keeps_the_newest_entries(search_cache):
+    search_cache.max_entries = 2
+    for i in range(4):
+        search_cache.set('Artist', 'Title {}'.format(i), 'nid')
+        time.sleep(0.01)
+    search_cache.evict()
+    assert [search_cache.get('Artist', 'Title {}'.format(i)) for i in range(4)] == [MISSING, MISSING, 'nid', 'nid']
+
+
+def test_cache_persists_across_runs(tmp_path):
+    cache_file = str(tmp_path / 'search_cache.sqlite')
+    cache = SearchCache(cache_file)
+    cache.set('Artist', 'Title', 'nid')
+    cache.close()
+    cache = SearchCache(cache_file)
+    assert cache.get('Artist', 'Title') == 'nid'
+    cache.close()
+
+
+def test_fetch_songs_searches_each_song_once(search_cache):
+    fetch_songs = pytest.importorskip('gmusic.fetch_songs')
+    api = FakeApi({'Artist Title': [('Other', 'Title', 'other-nid'), ('The Artist', 'Title (Live)', 'nid')]})
+    google_music_fetch = fetch_songs.FetchSongs(api=api, search_cache=search_cache)
+    assert google_music_fetch.search_for_songs('Artist', 'Title') == 'nid'
+    assert google_music_fetch.search_for_songs('Artist', 'Title') == 'nid'
+    assert google_music_fetch.search_for_songs('Missing', 'Song') is None
+    assert google_music_fetch.search_for_songs('Missing', 'Song') is None
+    assert api.searches == ['Artist Title', 'Missing Song']
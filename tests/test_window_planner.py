@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import asyncio
+
+from gmusic.media_resources import MediaResources
+from gmusic.window_planner import ORIGIN, WindowPlanner
+
+END = datetime(2026, 10, 18, 12)
+START = END - timedelta(hours=48)
+# a play every 5 minutes over the planned range
+PLAYS = [END - timedelta(minutes=5 * i + 2) for i in range(48 * 12)]
+
+
+def run_planner(planner, page_size=None):
+    """ Record every window with the plays of PLAYS it holds, cut at page_size, returns the windows and plays seen """
+
+    windows, seen = [], set()
+    while True:
+        window = planner.next_window()
+        if window is None:
+            if planner.done:
+                return windows, seen
+            continue
+        windows.append(window)
+        since, until = datetime.fromisoformat(window.since), datetime.fromisoformat(window.until)
+        plays = [play for play in PLAYS if since <= play < until]
+        plays = plays[:page_size] if page_size else plays
+        seen.update(plays)
+        planner.record(window, len(plays))
+
+
+def test_windows_cover_the_range_without_overlap():
+    planner = WindowPlanner(END, START, timedelta(hours=8))
+    windows = sorted((window.since, window.until) for window in planner.windows())
+    assert windows[0][0] == START.isoformat()
+    assert windows[-1][1] == END.isoformat()
+    for (_, until), (since, _) in zip(windows, windows[1:]):
+        assert until == since
+
+
+def test_past_windows_are_aligned_on_their_width():
+    planner = WindowPlanner(END + timedelta(minutes=7), START, timedelta(hours=8))
+    for window in list(planner.windows())[1:-1]:
+        since, until = datetime.fromisoformat(window.since), datetime.fromisoformat(window.until)
+        assert (since - ORIGIN) % (until - since) == timedelta(0)
+
+
+def test_known_page_size_splits_full_windows():
+    windows, seen = run_planner(WindowPlanner(END, START, timedelta(hours=8), page_size=20, lookahead=4), 20)
+    assert seen == set(PLAYS)
+    assert len(windows) > 6
+
+
+def test_page_size_is_inferred_and_the_full_windows_split():
+    planner = WindowPlanner(END, START, timedelta(hours=8), maximum=timedelta(hours=32), lookahead=4)
+    windows, seen = run_planner(planner, 20)
+    assert planner.page_size == 20
+    assert seen == set(PLAYS)
+
+
+def test_uncut_responses_do_not_infer_a_page_size():
+    planner = WindowPlanner(END, START, timedelta(hours=8), maximum=timedelta(hours=32), lookahead=4)
+    windows, seen = run_planner(planner)
+    assert planner.page_size is None
+    assert seen == set(PLAYS)
+    assert len(windows) <= len(list(WindowPlanner(END, START, timedelta(hours=8)).windows()))
+
+
+def test_planner_that_is_not_adaptive_keeps_its_widths():
+    planner = WindowPlanner(END, START, timedelta(hours=8), lookahead=4, adaptive=False)
+    windows, _ = run_planner(planner, 20)
+    assert planner.page_size is None
+    assert len(windows) == len(list(WindowPlanner(END, START, timedelta(hours=8)).windows()))
+
+
+def test_empty_windows_end_the_history():
+    planner = WindowPlanner(END, START, timedelta(hours=1), empty_limit=3, lookahead=1)
+    count = 0
+    while not planner.done:
+        window = planner.next_window()
+        count += 1
+        planner.record(window, 0)
+    assert planner.exhausted
+    assert count == 3
+    assert planner.remaining() == []
+
+
+def stream(media_resources, station, name):
+    config = media_resources.radio_stations[station]
+    url = config['urls'][name]
+    failed = []
+
+    async def collect():
+        return [song async for song in media_resources.stream_loop(
+            None, config['headers'], url, params=config['params'], station=station, interval=config['interval'],
+            name=name, failed=failed)]
+
+    return asyncio.run(collect()), failed
+
+
+def test_stream_loop_requests_the_halves_of_full_windows(station_server):
+    media_resources = station_server.configure(MediaResources(steps=3), 1, 1, 0)
+    songs, failed = stream(media_resources, 'tunegenie', 'tunegenie0')
+    # every response is full, so the 36 hours are split down to 15 minute windows
+    assert media_resources.radio_stations['tunegenie']['page_size'] == 20
+    assert station_server.requests >= 36 * 4
+    assert len(songs) == 20 * station_server.requests
+    assert failed == []
+
+
+def test_stream_loop_keeps_the_cbs_windows(station_server):
+    media_resources = station_server.configure(MediaResources(steps=3), 1, 1, 0)
+    songs, failed = stream(media_resources, 'cbs_stations', 'cbs0')
+    windows = list(media_resources.get_time_windows(media_resources.radio_stations['cbs_stations']['interval']))
+    assert station_server.requests == len(windows)
+    assert failed == []